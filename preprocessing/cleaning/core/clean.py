@@ -16,11 +16,17 @@ Cleaning strategy:
 
 import re
 import json
+import mmap
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 from collections import Counter
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback; orjson is only a speedup
+    orjson = None
 
 # --- PATH CONFIG ---
 RAW_DIR = Path(__file__).parent.parent.parent.parent / "datasets" / "core" / "chats_raw"
@@ -54,6 +60,16 @@ MEDIA_PATTERNS = [
     "video",
 ]
 
+# Every system/media phrase folded into one case-insensitive literal alternation,
+# so a message is checked in a single scan without building a lowercased copy.
+# ASCII casing only: Unicode folding would also let "ſ" match "s", which
+# message.lower() never did. The Kelvin sign (U+212A), which .lower() maps to
+# "k", is the one character this no longer folds.
+_NOISE_RE = re.compile(
+    "|".join(re.escape(p) for p in SYSTEM_PATTERNS + MEDIA_PATTERNS),
+    re.IGNORECASE | re.ASCII,
+)
+
 # --- SUBSTRINGS TO STRIP FROM MESSAGES ---
 # Unlike system messages that filter entire messages, these substrings are removed
 # from message text while preserving the user's actual intent.
@@ -68,20 +84,54 @@ PII_PATTERNS = {
     "IBAN": r"\b[A-Z]{2}\d{2}[A-Z0-9]{1,30}\b",
 }
 
+# Fused into one alternation so a single pass masks every PII type;
+# the matching group name doubles as the mask label.
+_PII_RE = re.compile(
+    "|".join(f"(?P<{pii_type}>{pattern})" for pii_type, pattern in PII_PATTERNS.items()),
+    re.IGNORECASE,
+)
+_WS_RE = re.compile(r"\s+")
+_ASCII_ALNUM = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789")
+
+
+# --- RAW LINE FORMATS ---
+# iPhone ([DD/MM/YYYY, HH:MM:SS]) and Android (DD/MM/YYYY, HH:MM -) headers share
+# the date/time groups; an opening "[" selects the iPhone tail via a conditional
+# group. Matched at line starts over the mmapped export. U+200E marks and every
+# character str.strip() removes (str.isspace, less the line breaks) are skipped
+# before the header, as UTF-8 bytes: NBSP and U+0085 (\xc2..), U+1680 (\xe1..),
+# U+2000-U+200A, U+200E, U+2028, U+2029, U+202F, U+205F (\xe2..), U+3000 (\xe3..).
+_LINE_RE = re.compile(
+    rb"^(?:[ \t\f\v\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80"
+    rb"|\xe2\x80[\x80-\x8a\x8e\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80)*"
+    rb"(?P<bracket>\[)?(?P<day>\d{1,2})/(?P<month>\d{1,2})/(?P<year>\d{4}), "
+    rb"(?P<hour>\d{2}):(?P<minute>\d{2})(?(bracket):(?P<second>\d{2})\]| -)"
+    rb" (?P<sender>[^\r\n]*?): (?P<msg>[^\r\n]*)",
+    re.MULTILINE,
+)
 
 MIN_MESSAGE_LENGTH = 3
 
 def is_noise(message: str) -> bool:
     """Return True if message is system/media noise."""
-    lower_msg = message.lower()
-    return any(p.lower() in lower_msg for p in SYSTEM_PATTERNS + MEDIA_PATTERNS)
+    return _NOISE_RE.search(message) is not None
 
 
 def is_too_short(message: str) -> bool:
     """Return True if message is too short (likely noise)."""
-    # Count only alphanumeric and space characters (excludes emojis)
-    text_only = re.sub(r'[^a-zA-Z0-9\s]', '', message)
-    return len(text_only.strip()) < MIN_MESSAGE_LENGTH
+    # Length of the message reduced to ASCII alphanumerics and whitespace, then
+    # stripped (so emojis don't count). Returns as soon as the limit is reached.
+    length = 0
+    trailing_spaces = 0
+    for ch in message:
+        if ch in _ASCII_ALNUM:
+            length += trailing_spaces + 1
+            trailing_spaces = 0
+            if length >= MIN_MESSAGE_LENGTH:
+                return False
+        elif length and ch.isspace():
+            trailing_spaces += 1
+    return True
 
 
 def strip_substrings(message: str) -> str:
@@ -93,115 +143,115 @@ def strip_substrings(message: str) -> str:
 
 def mask_pii(message: str) -> str:
     """Mask high-risk PII deterministically using regex."""
-    for pii_type, pattern in PII_PATTERNS.items():
-        message = re.sub(pattern, f"[{pii_type}]", message, flags=re.IGNORECASE)
-    return message
+    return _PII_RE.sub(lambda m: f"[{m.lastgroup}]", message)
 
 
-def parse_chat_line_iphone(line: str) -> Optional[Tuple[datetime, str, str]]:
-    """
-    Parse WhatsApp iPhone-style line: [DD/MM/YYYY, HH:MM:SS] Sender: Message
-    Returns (timestamp, sender, message) or None if invalid.
+def iter_chat_lines(filepath: Path) -> Iterator[Tuple[datetime, str, str]]:
     """
-    line = line.replace("\u200e", "").strip()
-    pattern = r"\[(\d{1,2}/\d{1,2}/\d{4}), (\d{2}:\d{2}:\d{2})\] (.*?): (.*)"
-    match = re.match(pattern, line)
-    if not match:
-        return None
-    date_str, time_str, sender, message = match.groups()
-    try:
-        timestamp = datetime.strptime(f"{date_str} {time_str}", "%d/%m/%Y %H:%M:%S")
-    except ValueError:
-        return None
-    return timestamp, sender.strip(), message.strip()
-
-
-def parse_chat_line_android(line: str) -> Optional[Tuple[datetime, str, str]]:
+    Yield (timestamp, sender, message) for every message line in a raw export.
+    Handles both WhatsApp iPhone ([DD/MM/YYYY, HH:MM:SS] Sender: Message) and
+    Android (DD/MM/YYYY, HH:MM - Sender: Message) lines in one regex scan over
+    the memory-mapped file; lines that are neither are skipped.
     """
-    Parse WhatsApp Android-style line: DD/MM/YYYY, HH:MM - Sender: Message
-    Returns (timestamp, sender, message) or None if invalid.
-    """
-    line = line.replace("\u200e", "").strip()
-    pattern = r"(\d{1,2}/\d{1,2}/\d{4}), (\d{2}:\d{2}) - (.*?): (.*)"
-    match = re.match(pattern, line)
-    if not match:
-        return None
-    date_str, time_str, sender, message = match.groups()
-    try:
-        timestamp = datetime.strptime(f"{date_str} {time_str}", "%d/%m/%Y %H:%M")
-    except ValueError:
-        return None
-    return timestamp, sender.strip(), message.strip()
-
-
-def parse_chat_line(line: str) -> Optional[Tuple[datetime, str, str]]:
-    """Try iPhone format first, then Android."""
-    result = parse_chat_line_iphone(line)
-    if result:
-        return result
-    return parse_chat_line_android(line)
-
-
-def load_and_clean_chat_file(filepath: Path) -> List[dict]:
+    if filepath.stat().st_size == 0:
+        return
+    with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for match in _LINE_RE.finditer(mm):
+            day, month, year, hour, minute, second = match.group(
+                "day", "month", "year", "hour", "minute", "second"
+            )
+            try:
+                timestamp = datetime(
+                    int(year), int(month), int(day), int(hour), int(minute), int(second or 0)
+                )
+            except ValueError:
+                continue
+            sender = match["sender"].decode("utf-8").replace("\u200e", "").strip()
+            message = match["msg"].decode("utf-8").replace("\u200e", "").strip()
+            yield timestamp, sender, message
+
+
+def load_and_clean_chat_file(filepath: Path) -> Tuple[List[str], List[str], List[str]]:
     """
-    Load raw chat file, filter noise, mask PII, and return cleaned messages.
+    Load raw chat file, filter noise, mask PII, and return cleaned messages
+    as parallel (timestamps, senders, messages) lists.
     
     Filtering steps:
-    1. Parse timestamp, sender, message
+    1. Parse timestamp, sender, message (see iter_chat_lines)
     2. Remove system/media messages
     3. Remove very short messages (< 3 chars)
     4. Normalize whitespace (preserve emojis)
     5. Mask PII (phone, email, credit card, IBAN)
     """
-    messages = []
-    with open(filepath, "r", encoding="utf-8") as f:
-        for line in f:
-            parsed = parse_chat_line(line)
-            if not parsed:
-                continue
-            timestamp, sender, message = parsed
-            
-            if is_noise(message):
-                continue
-            
-            message = strip_substrings(message)
-            message = re.sub(r"\s+", " ", message).strip()
-            if not message:
-                continue
-            
-            if is_too_short(message):
-                continue
-            
-            message = mask_pii(message)
-            
-            messages.append({
-                "timestamp": timestamp.isoformat(),
-                "sender": sender,
-                "message": message,
-            })
-    
-    return messages
-
-
-def main():
-    """Clean all raw chat files and save as JSON."""
-    for file in sorted(RAW_DIR.glob("*.txt")):
-        print(f"Cleaning {file.name} ...")
-        
-        persona = file.stem.upper()
-        
-        messages = load_and_clean_chat_file(file)
-        if not messages:
-            print(f"No valid messages found.")
+    timestamps: List[str] = []
+    senders: List[str] = []
+    messages: List[str] = []
+    for timestamp, sender, message in iter_chat_lines(filepath):
+        if is_noise(message):
             continue
         
-        print(f"Cleaned {len(messages)} messages")
+        message = strip_substrings(message)
+        message = _WS_RE.sub(" ", message).strip()
+        if not message:
+            continue
         
-        output_path = CLEANED_DIR / f"{persona}.json"
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(messages, f, indent=2, ensure_ascii=False)
+        if is_too_short(message):
+            continue
         
-        print(f"Saved to {output_path}")
+        timestamps.append(timestamp.isoformat())
+        senders.append(sender)
+        messages.append(mask_pii(message))
+    
+    return timestamps, senders, messages
+
+
+def write_cleaned_json(
+    output_path: Path, timestamps: List[str], senders: List[str], messages: List[str]
+) -> None:
+    """
+    Write parallel message columns as a JSON list of {timestamp, sender, message},
+    one record at a time, in the same layout as json.dump(..., indent=2).
+    """
+    with open(output_path, "wb") as f:
+        f.write(b"[\n")
+        separator = b"  "
+        for timestamp, sender, message in zip(timestamps, senders, messages):
+            record = {"timestamp": timestamp, "sender": sender, "message": message}
+            if orjson is not None:
+                encoded = orjson.dumps(record, option=orjson.OPT_INDENT_2)
+            else:
+                encoded = json.dumps(record, indent=2, ensure_ascii=False).encode("utf-8")
+            # Nest one level deeper; JSON strings never contain a raw newline
+            f.write(separator + encoded.replace(b"\n", b"\n  "))
+            separator = b",\n  "
+        f.write(b"\n]")
+
+
+def clean_file(file: Path) -> Tuple[int, Optional[Path]]:
+    """Clean one raw chat file; return (message count, output path or None)."""
+    persona = file.stem.upper()
+    
+    timestamps, senders, messages = load_and_clean_chat_file(file)
+    if not messages:
+        return 0, None
+    
+    output_path = CLEANED_DIR / f"{persona}.json"
+    write_cleaned_json(output_path, timestamps, senders, messages)
+    
+    return len(messages), output_path
+
+
+def main():
+    """Clean all raw chat files (one process per file) and save as JSON."""
+    files = sorted(RAW_DIR.glob("*.txt"))
+    with ProcessPoolExecutor() as executor:
+        for file, (count, output_path) in zip(files, executor.map(clean_file, files)):
+            print(f"Cleaning {file.name} ...")
+            if output_path is None:
+                print(f"No valid messages found.")
+                continue
+            print(f"Cleaned {count} messages")
+            print(f"Saved to {output_path}")
 
 
 if __name__ == "__main__":
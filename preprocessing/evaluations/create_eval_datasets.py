@@ -5,9 +5,19 @@ import json
 import os
 import random
 import hashlib
+import heapq
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Tuple
+from typing import Any, BinaryIO, Dict, Iterable, List
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback; orjson is only a speedup
+    orjson = None
+
+# Encoded rows are joined and written in blocks of roughly this size
+WRITE_BATCH_BYTES = 64 * 1024 * 1024
 
 
 @dataclass(frozen=True)
@@ -19,22 +29,59 @@ class EvalSplitConfig:
     eval_ratio: float = 0.1
     min_eval_per_persona: int = 25
     max_eval_per_persona: int | None = None
+    workers: int | None = None
+
+
+def _dumps_line(row: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _dumps_pretty(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
 
 
 def _iter_jsonl(path: Path) -> Iterable[Dict[str, Any]]:
-    with path.open("r", encoding="utf-8") as f:
+    loads = orjson.loads if orjson is not None else json.loads
+    with path.open("rb") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
-            yield json.loads(line)
+            yield loads(line)
 
 
-def _write_jsonl(path: Path, rows: List[Dict[str, Any]]) -> None:
+def _count_jsonl(path: Path) -> int:
+    with path.open("rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def _open_jsonl(path: Path) -> BinaryIO:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
-        for row in rows:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return path.open("wb")
+
+
+def _read_lines(path: Path) -> List[bytes]:
+    """Serialized JSONL lines of a file this script wrote, without parsing them."""
+    with path.open("rb") as f:
+        return f.readlines()
+
+
+def _write_lines(path: Path, lines: Iterable[bytes]) -> None:
+    with _open_jsonl(path) as f:
+        pending: List[bytes] = []
+        pending_bytes = 0
+        for line in lines:
+            pending.append(line)
+            pending_bytes += len(line)
+            if pending_bytes >= WRITE_BATCH_BYTES:
+                f.write(b"".join(pending))
+                pending.clear()
+                pending_bytes = 0
+        f.write(b"".join(pending))
 
 
 def discover_persona_files(chats_processed_dir: Path) -> Dict[str, Path]:
@@ -46,23 +93,63 @@ def discover_persona_files(chats_processed_dir: Path) -> Dict[str, Path]:
     return persona_files
 
 
-def split_eval(rows: List[Dict[str, Any]], *, rng: random.Random, cfg: EvalSplitConfig) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-    if not rows:
-        return [], []
+def split_eval(total: int, *, persona: str, cfg: EvalSplitConfig) -> bytearray:
+    """Return a per-row mask (1 = eval) over ``total`` rows; rows are streamed separately.
 
-    indices = list(range(len(rows)))
-    rng.shuffle(indices)
+    Each row index gets a BLAKE2b hash keyed by the seed, and the ``desired`` lowest
+    hashes go to eval. This is a deterministic pseudo-random sample with an exact
+    size (so min/max caps hold) and needs no shuffled index list.
+    """
+    is_eval = bytearray(total)
+    if total == 0:
+        return is_eval
 
-    desired = int(round(len(rows) * cfg.eval_ratio))
+    desired = int(round(total * cfg.eval_ratio))
     desired = max(desired, cfg.min_eval_per_persona)
-    desired = min(desired, len(rows))
+    desired = min(desired, total)
     if cfg.max_eval_per_persona is not None:
         desired = min(desired, cfg.max_eval_per_persona)
 
-    eval_idx = set(indices[:desired])
-    eval_rows = [rows[i] for i in range(len(rows)) if i in eval_idx]
-    remaining_rows = [rows[i] for i in range(len(rows)) if i not in eval_idx]
-    return eval_rows, remaining_rows
+    key = str(cfg.seed).encode("utf-8")
+
+    def row_hash(i: int) -> bytes:
+        return hashlib.blake2b(f"{persona}:{i}".encode("utf-8"), key=key, digest_size=8).digest()
+
+    for i in heapq.nsmallest(desired, range(total), key=row_hash):
+        is_eval[i] = 1
+    return is_eval
+
+
+def split_persona(persona: str, path: Path, cfg: EvalSplitConfig) -> Dict[str, Any]:
+    """Split one persona file, write its LoRA eval/train files, return stats.
+
+    Only the stats go back to the parent; it reads the serialized rows for the
+    combined SFT files back from the LoRA files instead of unpickling them.
+    """
+    total = _count_jsonl(path)
+    is_eval = split_eval(total, persona=persona, cfg=cfg)
+
+    # LoRA eval/train: per-persona sets (adapter-specific), streamed row by row
+    lora_out = cfg.output_dir / "lora" / f"{persona}.jsonl"
+    lora_train_out = cfg.train_dir / "lora" / f"{persona}.jsonl"
+    eval_count = 0
+    with _open_jsonl(lora_out) as eval_f, _open_jsonl(lora_train_out) as train_f:
+        for i, row in enumerate(_iter_jsonl(path)):
+            line = _dumps_line(row)
+            if is_eval[i]:
+                eval_f.write(line)
+                eval_count += 1
+            else:
+                train_f.write(line)
+
+    return {
+        "source_file": str(path),
+        "total": total,
+        "eval": eval_count,
+        "remaining": total - eval_count,
+        "lora_eval_path": str(lora_out),
+        "lora_train_path": str(lora_train_out),
+    }
 
 
 def build_eval_datasets(cfg: EvalSplitConfig) -> Dict[str, Any]:
@@ -74,8 +161,9 @@ def build_eval_datasets(cfg: EvalSplitConfig) -> Dict[str, Any]:
             f"No persona jsonl files found in {cfg.input_dir}. Expected files like persona_1.jsonl, persona_2.jsonl, persona_3.jsonl"
         )
 
-    sft_eval_all: List[Dict[str, Any]] = []
-    sft_train_all: List[Dict[str, Any]] = []
+    # Serialized rows; shuffling lines permutes them exactly like the parsed rows
+    sft_eval_all: List[bytes] = []
+    sft_train_all: List[bytes] = []
     summary: Dict[str, Any] = {
         "input_dir": str(cfg.input_dir),
         "output_dir": str(cfg.output_dir),
@@ -87,48 +175,32 @@ def build_eval_datasets(cfg: EvalSplitConfig) -> Dict[str, Any]:
         "personas": {},
     }
 
-    for persona, path in persona_files.items():
-        rows = list(_iter_jsonl(path))
-
-        # For determinism per persona, fork RNG with a stable seed derived from base seed + persona.
-        seed_material = f"{cfg.seed}:{persona}".encode("utf-8")
-        persona_seed = int.from_bytes(hashlib.sha256(seed_material).digest()[:8], "big")
-        persona_rng = random.Random(persona_seed)
-        eval_rows, remaining_rows = split_eval(rows, rng=persona_rng, cfg=cfg)
-
-        # LoRA eval: per-persona eval set (adapter-specific)
-        lora_out = cfg.output_dir / "lora" / f"{persona}.jsonl"
-        _write_jsonl(lora_out, eval_rows)
-
-        # LoRA train: per-persona training set (adapter-specific)
-        lora_train_out = cfg.train_dir / "lora" / f"{persona}.jsonl"
-        _write_jsonl(lora_train_out, remaining_rows)
-
-        # SFT eval: combined eval set across personas (single-model evaluation)
-        sft_eval_all.extend(eval_rows)
+    # Personas are split in parallel; map() keeps persona order so the combined
+    # SFT shuffle below stays deterministic.
+    personas = list(persona_files)
+    with ProcessPoolExecutor(max_workers=cfg.workers) as executor:
+        results = executor.map(
+            split_persona, personas, persona_files.values(), [cfg] * len(personas)
+        )
+        for persona, stats in zip(personas, results):
+            # SFT eval: combined eval set across personas (single-model evaluation)
+            sft_eval_all.extend(_read_lines(Path(stats["lora_eval_path"])))
 
-        # SFT train: combined training set across personas
-        sft_train_all.extend(remaining_rows)
+            # SFT train: combined training set across personas
+            sft_train_all.extend(_read_lines(Path(stats["lora_train_path"])))
 
-        summary["personas"][persona] = {
-            "source_file": str(path),
-            "total": len(rows),
-            "eval": len(eval_rows),
-            "remaining": len(remaining_rows),
-            "lora_eval_path": str(lora_out),
-            "lora_train_path": str(lora_train_out),
-        }
+            summary["personas"][persona] = stats
 
     # Write combined SFT eval file
     sft_out = cfg.output_dir / "sft" / "conversations_eval.jsonl"
     # Shuffle combined eval for better mixing
     rng.shuffle(sft_eval_all)
-    _write_jsonl(sft_out, sft_eval_all)
+    _write_lines(sft_out, sft_eval_all)
 
     # Write combined SFT training file
     sft_train_out = cfg.train_dir / "sft" / "conversations_train.jsonl"
     rng.shuffle(sft_train_all)
-    _write_jsonl(sft_train_out, sft_train_all)
+    _write_lines(sft_train_out, sft_train_all)
     summary["sft"] = {
         "eval_total": len(sft_eval_all),
         "sft_eval_path": str(sft_out),
@@ -145,7 +217,7 @@ def build_eval_datasets(cfg: EvalSplitConfig) -> Dict[str, Any]:
 
     meta_path = cfg.output_dir / "meta.json"
     meta_path.parent.mkdir(parents=True, exist_ok=True)
-    meta_path.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    meta_path.write_bytes(_dumps_pretty(summary))
     return summary
 
 
@@ -190,6 +262,12 @@ def parse_args() -> EvalSplitConfig:
         default=None,
         help="Optional cap for eval conversations per persona",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes used to split persona files (default: CPU count)",
+    )
 
     args = parser.parse_args()
 
@@ -201,6 +279,7 @@ def parse_args() -> EvalSplitConfig:
         eval_ratio=args.eval_ratio,
         min_eval_per_persona=args.min_eval_per_persona,
         max_eval_per_persona=args.max_eval_per_persona,
+        workers=args.workers,
     )
 
 
@@ -1,12 +1,19 @@
 import argparse
+import asyncio
 import json
 import os
 import re
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
-import requests
+from typing import AbstractSet, Any, Dict, Iterable, Iterator, List, Tuple
+import httpx
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback; orjson is only a speedup
+    orjson = None
 
 
 # Paths (relative to repo root inferred from this file location)
@@ -41,6 +48,13 @@ MEDIA_PATTERNS = [
     "document",
     "video",
 ]
+# Kept as separate matchers so system and media hits keep distinct reason tags;
+# case-insensitive so messages are not lowercased first.
+# ASCII casing only: Unicode folding would also let "ſ" match "s", which
+# message.lower() never did. The Kelvin sign (U+212A), which .lower() maps to
+# "k", is the one character this no longer folds.
+_SYSTEM_RE = re.compile("|".join(re.escape(p) for p in SYSTEM_PATTERNS), re.IGNORECASE | re.ASCII)
+_MEDIA_RE = re.compile("|".join(re.escape(p) for p in MEDIA_PATTERNS), re.IGNORECASE | re.ASCII)
 # Timestamps or header-like artifacts that may slip through if parsing missed a line
 EXPORT_HEADER_PATTERNS = [
     r"\[?\d{1,2}/\d{1,2}/\d{2,4}[,\s]+\d{1,2}:\d{2}(:\d{2})?\]?",  # [DD/MM/YYYY, HH:MM(:SS)]
@@ -55,34 +69,54 @@ PII_REGEX = {
     "PHONE": r"\+?\d{1,3}[\s-]?(?:\(\d+\))?[\s-]?\d{3,}[\s-]?\d{3,}",
 }
 
+_HEADER_RES = [re.compile(p) for p in EXPORT_HEADER_PATTERNS]
+_PII_RES = {name: re.compile(rx, re.IGNORECASE) for name, rx in PII_REGEX.items()}
+# Header and PII checks fused into one alternation, used only as a prefilter:
+# most messages match none of them and are scanned once instead of six times.
+# Matches of the alternation don't overlap (a phone number can swallow the
+# digits of a card number), so messages that hit are re-checked per pattern.
+_SCAN_PREFILTER_RE = re.compile(
+    "|".join(EXPORT_HEADER_PATTERNS + list(PII_REGEX.values())), re.IGNORECASE
+)
+
+# Fenced ```json block in LLM output
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\n([\s\S]*?)\n```")
+
 
 def load_cleaned(path: Path) -> List[Dict[str, Any]]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    data = path.read_bytes()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
 
 
-def pattern_scan(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def write_json(path: Path, obj: Any) -> None:
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def pattern_scan(texts: List[str]) -> List[Dict[str, Any]]:
     findings: List[Dict[str, Any]] = []
-    for i, m in enumerate(messages):
-        text = str(m.get("message", ""))
-        lower = text.lower()
+    for i, text in enumerate(texts):
         reasons: List[str] = []
-        if any(p in lower for p in SYSTEM_PATTERNS):
+        if _SYSTEM_RE.search(text):
             reasons.append("whatsapp_system_phrase")
-        if any(p in lower for p in MEDIA_PATTERNS):
+        if _MEDIA_RE.search(text):
             reasons.append("media_artifact")
-        if any(re.search(p, text) for p in EXPORT_HEADER_PATTERNS):
-            reasons.append("timestamp_or_export_header")
-        for name, rx in PII_REGEX.items():
-            if re.search(rx, text, flags=re.IGNORECASE):
-                reasons.append(f"pii_residue:{name}")
+        if _SCAN_PREFILTER_RE.search(text):
+            if any(rx.search(text) for rx in _HEADER_RES):
+                reasons.append("timestamp_or_export_header")
+            for name, rx in _PII_RES.items():
+                if rx.search(text):
+                    reasons.append(f"pii_residue:{name}")
         if reasons:
             findings.append({"index": i, "reason": ",".join(reasons), "snippet": text[:200]})
     return findings
 
 
-def chunk(lst: List[Any], n: int) -> List[List[Any]]:
-    return [lst[i : i + n] for i in range(0, len(lst), n)]
+def chunk(lst: List[Any], n: int) -> Iterator[List[Any]]:
+    for i in range(0, len(lst), n):
+        yield lst[i : i + n]
 
 
 def build_prompt(batch: List[Tuple[int, str]]) -> List[Dict[str, str]]:
@@ -110,9 +144,9 @@ def build_prompt(batch: List[Tuple[int, str]]) -> List[Dict[str, str]]:
     ]
 
 
-def call_openai_chat(model: str, messages: List[Dict[str, str]], timeout: int = 60) -> str:
+def make_openai_client(http_client: httpx.AsyncClient) -> Any:
     try:
-        from openai import OpenAI
+        from openai import AsyncOpenAI
     except Exception as e:
         raise RuntimeError(
             "openai package is required. Install with: pip install openai"
@@ -122,8 +156,11 @@ def call_openai_chat(model: str, messages: List[Dict[str, str]], timeout: int =
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY is not set in environment")
 
-    client = OpenAI()
-    resp = client.chat.completions.create(
+    return AsyncOpenAI(http_client=http_client)
+
+
+async def call_openai_chat(client: Any, model: str, messages: List[Dict[str, str]], timeout: int = 60) -> str:
+    resp = await client.chat.completions.create(
         model=model,
         messages=messages,
         temperature=0,
@@ -132,7 +169,9 @@ def call_openai_chat(model: str, messages: List[Dict[str, str]], timeout: int =
     return resp.choices[0].message.content or ""
 
 
-def call_ollama_chat(model: str, messages: List[Dict[str, str]], base_url: str, timeout: int = 60) -> str:
+async def call_ollama_chat(
+    client: httpx.AsyncClient, model: str, messages: List[Dict[str, str]], base_url: str, timeout: int = 60
+) -> str:
     """Call an Ollama chat model via REST API and return assistant text content.
 
     Expects an Ollama server (default http://localhost:11434). Uses /api/chat with stream=false.
@@ -148,7 +187,7 @@ def call_ollama_chat(model: str, messages: List[Dict[str, str]], base_url: str,
         "options": {"temperature": 0},
     }
     try:
-        resp = requests.post(url, json=payload, timeout=timeout)
+        resp = await client.post(url, json=payload, timeout=timeout)
         resp.raise_for_status()
         data = resp.json()
         # When stream=false, Ollama returns a single object with message.content
@@ -162,7 +201,7 @@ def call_ollama_chat(model: str, messages: List[Dict[str, str]], base_url: str,
         if not content:
             raise ValueError("No content field in Ollama response")
         return content
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise RuntimeError(f"Ollama request failed: {e}")
 
 
@@ -173,7 +212,7 @@ def parse_json_block(text: str) -> Dict[str, Any]:
     except Exception:
         pass
     # Try fenced code blocks
-    m = re.search(r"```(?:json)?\n([\s\S]*?)\n```", text)
+    m = _JSON_FENCE_RE.search(text)
     if m:
         try:
             return json.loads(m.group(1))
@@ -190,34 +229,85 @@ def parse_json_block(text: str) -> Dict[str, Any]:
     raise ValueError("Could not parse JSON from model output")
 
 
+async def _llm_scan_batches(
+    batches: Iterable[List[Tuple[int, str]]],
+    provider: str,
+    model: str,
+    base_url: str,
+    timeout: int,
+    ppm_delay: float,
+    concurrency: int,
+) -> List[Dict[str, Any]]:
+    if provider not in ("openai", "ollama"):
+        raise ValueError(f"Unsupported provider: {provider}")
+    results: Dict[int, Dict[str, Any]] = {}
+    pending = enumerate(batches)
+
+    # One keep-alive pool per file, sized to the concurrency so every slot reuses
+    # its connection; the OpenAI client is built on the same pool.
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as http_client:
+        openai_client = make_openai_client(http_client) if provider == "openai" else None
+
+        async def worker() -> None:
+            # Workers share the lazy batch iterator, so batches are only sliced
+            # as a slot frees up rather than all scheduled up front.
+            for i, batch in pending:
+                prompt = build_prompt(batch)
+                if openai_client is not None:
+                    out = await call_openai_chat(openai_client, model, prompt, timeout=timeout)
+                else:
+                    out = await call_ollama_chat(http_client, model, prompt, base_url=base_url, timeout=timeout)
+                results[i] = parse_json_block(out)
+                # light rate limiting: each slot pauses before taking its next batch
+                if ppm_delay > 0:
+                    await asyncio.sleep(ppm_delay)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # The first failure fails the scan: stop the other slots instead of
+            # letting them drain the remaining batches, and let them unwind
+            # before the client closes.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return [results[i] for i in range(len(results))]
+
+
 def llm_scan(
-    messages: List[Dict[str, Any]],
+    texts: List[str],
     provider: str,
     model: str,
     base_url: str,
     batch_size: int,
     timeout: int,
     ppm_delay: float,
+    concurrency: int = 4,
+    skip: AbstractSet[int] = frozenset(),
 ) -> List[Dict[str, Any]]:
+    """Flag artifacts with the LLM; indices in ``skip`` (already flagged) are not sent."""
     findings: List[Dict[str, Any]] = []
-    pairs: List[Tuple[int, str]] = [(i, str(m.get("message", ""))) for i, m in enumerate(messages)]
-    for batch in chunk(pairs, batch_size):
-        prompt = build_prompt(batch)
-        if provider == "openai":
-            out = call_openai_chat(model, prompt, timeout=timeout)
-        elif provider == "ollama":
-            out = call_ollama_chat(model, prompt, base_url=base_url, timeout=timeout)
-        else:
-            raise ValueError(f"Unsupported provider: {provider}")
-        data = parse_json_block(out)
+    pairs: List[Tuple[int, str]] = [(i, text) for i, text in enumerate(texts) if i not in skip]
+    results = asyncio.run(
+        _llm_scan_batches(
+            chunk(pairs, batch_size),
+            provider=provider,
+            model=model,
+            base_url=base_url,
+            timeout=timeout,
+            ppm_delay=ppm_delay,
+            concurrency=concurrency,
+        )
+    )
+    for data in results:
         for f in data.get("findings", []):
             idx = int(f.get("index"))
             reason = str(f.get("reason", "llm_flag"))
-            snippet = messages[idx].get("message", "")[:200]
+            snippet = texts[idx][:200]
             findings.append({"index": idx, "reason": reason, "snippet": snippet})
-        # light rate limiting between calls
-        if ppm_delay > 0:
-            time.sleep(ppm_delay)
     return findings
 
 
@@ -241,25 +331,30 @@ def scan_file(
     timeout: int,
     ppm_delay: float,
     pattern_only: bool,
+    concurrency: int = 4,
 ) -> Dict[str, Any]:
     messages = load_cleaned(path)
     if max_messages > 0:
         messages = messages[:max_messages]
     persona = path.stem
+    # Message text is pulled out once and shared by both scan passes
+    texts = [str(m.get("message", "")) for m in messages]
 
-    deterministic = pattern_scan(messages)
+    deterministic = pattern_scan(texts)
     all_findings = list(deterministic)
 
     if not pattern_only and model:
         try:
             llm_findings = llm_scan(
-                messages,
+                texts,
                 provider=provider,
                 model=model,
                 base_url=base_url,
                 batch_size=batch_size,
                 timeout=timeout,
                 ppm_delay=ppm_delay,
+                concurrency=concurrency,
+                skip={f["index"] for f in deterministic},
             )
             all_findings = merge_findings(all_findings, llm_findings)
         except Exception as e:
@@ -284,8 +379,7 @@ def scan_file(
 def save_report(report: Dict[str, Any]) -> Path:
     persona = report.get("persona", "report")
     out_path = EVALS_DIR / f"{persona}.llm_system_scan.json"
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(report, f, ensure_ascii=False, indent=2)
+    write_json(out_path, report)
     return out_path
 
 
@@ -298,8 +392,10 @@ def main():
     p.add_argument("--max-messages-per-file", type=int, default=0, help="Limit messages per file (0 = all)")
     p.add_argument("--batch-size", type=int, default=50, help="Messages per LLM call")
     p.add_argument("--timeout", type=int, default=60, help="Per-call timeout seconds")
-    p.add_argument("--ppm-delay", type=float, default=0.4, help="Sleep between calls (seconds)")
+    p.add_argument("--ppm-delay", type=float, default=0.4, help="Sleep after each call, per concurrent slot (seconds)")
+    p.add_argument("--concurrency", type=int, default=4, help="LLM calls in flight at once, shared by all worker processes")
     p.add_argument("--pattern-only", action="store_true", help="Skip LLM calls; run deterministic scan only")
+    p.add_argument("--workers", type=int, default=None, help="Files scanned in parallel processes (default: CPU count, at most --concurrency)")
     args = p.parse_args()
 
     in_dir = Path(args.input_dir)
@@ -314,28 +410,41 @@ def main():
         "files": [],
     }
 
-    for path in sorted(in_dir.glob("*.json")):
-        print(f"Scanning {path.name} ...")
-        report = scan_file(
-            path=path,
-            provider=args.provider,
-            model=None if args.pattern_only else args.model,
-            base_url=args.ollama_base_url,
-            max_messages=args.max_messages_per_file,
-            batch_size=args.batch_size,
-            timeout=args.timeout,
-            ppm_delay=args.ppm_delay,
-            pattern_only=args.pattern_only,
-        )
-        reports["files"].append(report)
+    paths = sorted(in_dir.glob("*.json"))
+    # All workers hit the same LLM server, so --concurrency is split between
+    # them rather than granted to each one.
+    max_workers = min(args.workers or os.cpu_count() or 1, max(1, len(paths)))
+    if not args.pattern_only:
+        max_workers = min(max_workers, max(1, args.concurrency))
+    concurrency = max(1, args.concurrency // max_workers)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                scan_file,
+                path=path,
+                provider=args.provider,
+                model=None if args.pattern_only else args.model,
+                base_url=args.ollama_base_url,
+                max_messages=args.max_messages_per_file,
+                batch_size=args.batch_size,
+                timeout=args.timeout,
+                ppm_delay=args.ppm_delay,
+                pattern_only=args.pattern_only,
+                concurrency=concurrency,
+            )
+            for path in paths
+        ]
+        for path, future in zip(paths, futures):
+            print(f"Scanning {path.name} ...")
+            report = future.result()
+            reports["files"].append(report)
 
-        out_path = save_report(report)
-        print(f"Report -> {out_path}")
+            out_path = save_report(report)
+            print(f"Report -> {out_path}")
 
     # Also write an aggregate index
     index_path = EVALS_DIR / "index.json"
-    with open(index_path, "w", encoding="utf-8") as f:
-        json.dump(reports, f, ensure_ascii=False, indent=2)
+    write_json(index_path, reports)
     print(f"Index -> {index_path}")
 
 
@@ -5,15 +5,37 @@ Human labelling UI for cleaned WhatsApp conversations.
 Supports multiple labelling modes (extensible for future VLM support).
 """
 
+import atexit
 import json
 import os
-from functools import wraps
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import BinaryIO, List, Dict, Optional, Tuple
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import NotFound
 import logging
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback; orjson is only a speedup
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within this process
+    fcntl = None
+
 # --- CONFIG ---
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 DATASETS_DIR = PROJECT_ROOT / "datasets" / "core"
@@ -29,6 +51,12 @@ VLM_LABELED_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_FILE = LABELED_DIR / "conversations.jsonl"
 VLM_OUTPUT_FILE = VLM_LABELED_DIR / "labeled_examples.jsonl"
 
+# Serialized context-window responses kept per session (oldest evicted first)
+CONTEXT_WINDOW_CACHE_SIZE = 256
+
+# Sessions idle for longer than this are dropped from memory
+SESSION_IDLE_TIMEOUT_SECONDS = int(os.environ.get("SESSION_IDLE_TIMEOUT_SECONDS", str(12 * 60 * 60)))
+
 # --- PASSWORD CONFIG ---
 LABELING_PASSWORD = os.environ.get("LABELING_PASSWORD", "labeling123")
 
@@ -39,21 +67,172 @@ YOUR_NAME = os.environ.get("YOUR_NAME", "Festus")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Global state
-current_mode = None
-current_persona = None
-all_messages = []
-all_messages_unfiltered = []  # For VLM: all messages including non-image ones for context
-current_index = 0
-current_conversation = []
-labeled_conversations = []
-vlm_undo_stack = []  # Track labeled examples for undo functionality
+
+# --- SESSION STATE ---
+@dataclass
+class SessionState:
+    """Labelling state of one browser session."""
+    current_mode: Optional[str] = None
+    current_persona: Optional[str] = None
+    progress_file: Optional[Path] = None  # Resolved once per mode/persona selection
+    all_messages: List[Dict] = field(default_factory=list)
+    all_messages_unfiltered: List[Dict] = field(default_factory=list)  # For VLM: all messages including non-image ones for context
+    image_unfiltered_positions: List[int] = field(default_factory=list)  # For VLM: position in all_messages_unfiltered of each image message
+    current_index: int = 0
+    current_conversation: List[Dict] = field(default_factory=list)
+    labeled_count: int = 0  # Conversations/examples labeled; the items themselves live in the JSONL output
+    labeled_message_count: int = 0
+    vlm_undo_stack: List[int] = field(default_factory=list)  # Track byte offset of each labeled example in its JSONL file for undo functionality
+    context_window_cache: Dict[int, bytes] = field(default_factory=dict)  # For VLM: current_index -> context-window response body
+    last_seen: float = field(default_factory=time.monotonic)  # For idle eviction from SESSIONS
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)  # Held by handlers that move current_index/current_conversation
+
+
+# Live sessions keyed by the "sid" stored in the Flask session cookie
+SESSIONS: Dict[str, SessionState] = {}
+_sessions_lock = threading.Lock()
+_jsonl_writers: Dict[Path, BinaryIO] = {}  # Open append handles, one per output file
+_jsonl_lock = threading.RLock()  # Serializes handle creation and offset/write pairs across request threads
+# (output file, line offset) -> live session that saved the line; an undo may
+# only remove lines its own session saved or lines no live session owns
+_line_owners: Dict[Tuple[Path, int], SessionState] = {}
 
 
 # --- HELPER FUNCTIONS ---
-def get_progress_file(persona: str) -> Path:
+def json_loads(data: bytes):
+    """Parse JSON bytes (orjson when available)."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_line(obj) -> bytes:
+    """Serialize obj as one UTF-8 JSONL line (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@lru_cache(maxsize=8)
+def _load_json_cached(path_str: str, mtime_ns: int):
+    """Parse a JSON file once per (path, mtime); an edited file gets a new cache key."""
+    return json_loads(Path(path_str).read_bytes())
+
+
+def load_json_file(path: Path):
+    """
+    Load a large, rarely-changing JSON file, reusing the parsed object across
+    sessions. The result is shared, so callers must not change it beyond
+    idempotent normalization.
+    """
+    return _load_json_cached(str(path), path.stat().st_mtime_ns)
+
+
+def get_jsonl_writer(path: Path) -> BinaryIO:
+    """Return the cached append handle for a JSONL file, opening it if needed."""
+    f = _jsonl_writers.get(path)
+    if f is None:
+        f = _jsonl_writers[path] = open(path, "ab", buffering=1 << 16)
+    return f
+
+
+@contextmanager
+def file_lock(f: BinaryIO):
+    """Hold an exclusive advisory lock on an open file, so other processes can't interleave writes."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def append_jsonl(path: Path, obj) -> int:
+    """Append obj to a JSONL file; return the byte offset its line starts at."""
+    line = json_line(obj)
+    with _jsonl_lock:
+        f = get_jsonl_writer(path)
+        with file_lock(f):
+            # Another process may have appended since our last write
+            offset = f.seek(0, os.SEEK_END)
+            f.write(line)
+            f.flush()
+    return offset
+
+
+def append_offset(path: Path, offset: int):
+    """Append one little-endian int64 to an .offsets sidecar file."""
+    with _jsonl_lock:
+        f = get_jsonl_writer(path)
+        with file_lock(f):
+            f.write(struct.pack("<q", offset))
+            f.flush()
+
+
+def close_jsonl_writer(path: Path):
+    """Close the cached append handle for path, if any."""
+    with _jsonl_lock:
+        f = _jsonl_writers.pop(path, None)
+    if f is not None:
+        f.close()
+
+
+@atexit.register
+def close_jsonl_writers():
+    """Close all cached append handles."""
+    for path in list(_jsonl_writers):
+        close_jsonl_writer(path)
+
+
+def get_offsets_file(jsonl_path: Path) -> Path:
+    """Sidecar holding the start offset of every line in a JSONL file (one int64 each)."""
+    return jsonl_path.with_name(jsonl_path.name + ".offsets")
+
+
+def load_line_offsets(jsonl_path: Path) -> List[int]:
+    """
+    Return the start offset of every non-empty line in a JSONL file.
+
+    Read from the .offsets sidecar when it still describes the file (its last
+    offset starts the file's final line); otherwise rebuilt with one scan of
+    the file and written back.
+    """
+    offsets_path = get_offsets_file(jsonl_path)
+    size = jsonl_path.stat().st_size
+    if offsets_path.exists():
+        data = offsets_path.read_bytes()
+        if len(data) % 8 == 0:
+            offsets = [offset for (offset,) in struct.iter_unpack("<q", data)]
+            if not offsets:
+                if size == 0:
+                    return offsets
+            elif offsets[-1] < size:
+                with open(jsonl_path, "rb") as f:
+                    if offsets[-1] > 0:
+                        f.seek(offsets[-1] - 1)
+                        starts_line = f.read(1) == b"\n"
+                    else:
+                        starts_line = True
+                    last_line = f.readline()
+                    if starts_line and last_line.strip() and f.tell() == size:
+                        return offsets
+    
+    # Missing or stale sidecar: scan the JSONL once and rewrite it
+    offsets = []
+    with open(jsonl_path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                offsets.append(offset)
+            offset += len(line)
+    close_jsonl_writer(offsets_path)
+    offsets_path.write_bytes(struct.pack(f"<{len(offsets)}q", *offsets))
+    return offsets
+
+
+def get_progress_file(persona: str, mode: str) -> Path:
     """Get persona-specific progress file."""
-    if current_mode == "vlm":
+    if mode == "vlm":
         return VLM_LABELED_DIR / f".progress_{persona}.json"
     return LABELED_DIR / f".progress_{persona}.json"
 
@@ -70,65 +249,71 @@ def load_cleaned_messages(persona: str) -> List[Dict]:
     if not filepath.exists():
         raise FileNotFoundError(f"Cleaned file not found: {filepath}")
     
-    with open(filepath, "r", encoding="utf-8") as f:
-        messages = json.load(f)
+    messages = load_json_file(filepath)
     
     logger.info(f"Loaded {len(messages)} messages for persona: {persona}")
     return messages
 
 
-def load_vlm_cleaned_data(persona: str) -> Tuple[List[Dict], Path]:
-    """Load cleaned VLM data (messages with images)."""
+def load_vlm_cleaned_data(persona: str) -> List[Dict]:
+    """Load cleaned VLM data (all messages, with and without images)."""
     persona_dir = VLM_CLEANED_DIR / persona
     data_file = persona_dir / f"{persona}.json"
     
     if not data_file.exists():
         raise FileNotFoundError(f"VLM cleaned data not found: {data_file}")
     
-    with open(data_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    
-    all_messages = data.get("messages", [])
-    
-    # Filter to only image messages for VLM labeling
-    image_messages = [msg for msg in all_messages if msg.get("image")]
-    
-    logger.info(f"Loaded {len(all_messages)} total messages, {len(image_messages)} with images for persona: {persona}")
-    return image_messages, persona_dir
+    data = load_json_file(data_file)
+    return data.get("messages", [])
 
 
-def load_progress(persona: str) -> Dict:
+def load_progress(persona: str, mode: str) -> Dict:
     """Load labeling progress if it exists."""
-    progress_file = get_progress_file(persona)
+    progress_file = get_progress_file(persona, mode)
     if progress_file.exists():
-        with open(progress_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return json_loads(progress_file.read_bytes())
     return {
         "persona": persona,
         "current_index": 0,
-        "labeled_conversations": []
+        "labeled_count": 0,
+        "labeled_message_count": 0
     }
 
 
-def save_progress():
+def save_progress(state: SessionState):
     """Save current labeling progress."""
     progress = {
-        "persona": current_persona,
-        "current_index": current_index,
+        "persona": state.current_persona,
+        "current_index": state.current_index,
     }
     
-    # Only save labeled_conversations for core mode, not VLM
-    if current_mode != "vlm":
-        progress["labeled_conversations"] = labeled_conversations
+    # Only save labeled counts for core mode, not VLM
+    if state.current_mode != "vlm":
+        progress["labeled_count"] = state.labeled_count
+        progress["labeled_message_count"] = state.labeled_message_count
     
-    progress_file = get_progress_file(current_persona)
-    with open(progress_file, "w", encoding="utf-8") as f:
-        json.dump(progress, f, indent=2)
+    # Compact JSON, written to a temp file and swapped in so a crash mid-write
+    # never leaves a truncated progress file behind. Each save gets its own temp
+    # file: concurrent requests (or sessions on one persona) must not share one.
+    progress_file = state.progress_file
+    if orjson is not None:
+        data = orjson.dumps(progress)
+    else:
+        data = json.dumps(progress, ensure_ascii=False).encode("utf-8")
+    with tempfile.NamedTemporaryFile(
+        dir=progress_file.parent, prefix=progress_file.name + ".", suffix=".tmp", delete=False
+    ) as tmp:
+        tmp.write(data)
+    try:
+        os.replace(tmp.name, progress_file)
+    except OSError:
+        os.unlink(tmp.name)
+        raise
     
-    if current_mode == "vlm":
-        logger.info(f"Progress saved for {current_persona}: {current_index}/{len(all_messages)} images")
+    if state.current_mode == "vlm":
+        logger.info(f"Progress saved for {state.current_persona}: {state.current_index}/{len(state.all_messages)} images")
     else:
-        logger.info(f"Progress saved for {current_persona}: {current_index}/{len(all_messages)} messages")
+        logger.info(f"Progress saved for {state.current_persona}: {state.current_index}/{len(state.all_messages)} messages")
 
 
 def save_labeled_conversation(conversation: List[Dict], persona: str):
@@ -153,30 +338,14 @@ def save_labeled_conversation(conversation: List[Dict], persona: str):
         return
     
     # Merge consecutive messages from same sender
-    merged_messages = []
-    current_role = None
-    current_content = []
-    
-    for msg in conversation:
-        role = "assistant" if msg["sender"] == YOUR_NAME else "user"
-        
-        if role == current_role:
-            current_content.append(msg["message"])
-        else:
-            if current_role is not None:
-                merged_messages.append({
-                    "role": current_role,
-                    "content": "\n".join(current_content)
-                })
-            current_role = role
-            current_content = [msg["message"]]
-    
-    # Append final message
-    if current_role is not None:
-        merged_messages.append({
-            "role": current_role,
-            "content": "\n".join(current_content)
-        })
+    roles_and_messages = (
+        ("assistant" if msg["sender"] == YOUR_NAME else "user", msg["message"])
+        for msg in conversation
+    )
+    merged_messages = [
+        {"role": role, "content": "\n".join(content for _, content in run)}
+        for role, run in groupby(roles_and_messages, key=itemgetter(0))
+    ]
     
     # Skip conversations with no assistant messages
     has_assistant = any(msg["role"] == "assistant" for msg in merged_messages)
@@ -193,77 +362,138 @@ def save_labeled_conversation(conversation: List[Dict], persona: str):
     }
     
     # Append to JSONL
-    with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(conv_obj, ensure_ascii=False) + "\n")
+    append_jsonl(OUTPUT_FILE, conv_obj)
     
     logger.info(f"Saved conversation with {len(merged_messages)} messages")
 
 
-def save_vlm_labeled_example(example: Dict, persona: str):
+def save_vlm_labeled_example(state: SessionState, example: Dict):
     """Save a labeled VLM training example to JSONL."""
-    global vlm_undo_stack
-    
+    persona = state.current_persona
     out_path = get_vlm_output_file(persona)
-    with open(out_path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(example, ensure_ascii=False) + "\n")
+    # The line, its sidecar offset and its owner are recorded together, so an
+    # undo in another thread never sees the line without the rest
+    with _jsonl_lock:
+        offset = append_jsonl(out_path, example)
+        append_offset(get_offsets_file(out_path), offset)
+        _line_owners[(out_path, offset)] = state
     
-    vlm_undo_stack.append(example)
-    logger.info(f"Saved VLM example for {persona}. Undo stack size: {len(vlm_undo_stack)}")
+    state.vlm_undo_stack.append(offset)
+    logger.info(f"Saved VLM example for {persona}. Undo stack size: {len(state.vlm_undo_stack)}")
 
 
-def initialize_labeling(mode: str, persona: str):
+def undo_vlm_labeled_example(state: SessionState) -> Optional[str]:
+    """
+    Remove the session's most recent VLM example from its JSONL file.
+
+    All sessions on a persona append to the same file, so the example is only
+    removed while it is still the file's last line and no other live session
+    owns that line. Returns None on success, otherwise why nothing was removed.
+    """
+    offset = state.vlm_undo_stack[-1]
+    out_path = get_vlm_output_file(state.current_persona)
+    offsets_path = get_offsets_file(out_path)
+    with _jsonl_lock:
+        f = get_jsonl_writer(out_path)
+        with file_lock(f):
+            offsets = load_line_offsets(out_path)
+            owner = _line_owners.get((out_path, offset))
+            if offset not in offsets or owner not in (None, state):
+                # Already undone elsewhere (the offset may even hold someone
+                # else's line by now): forget it rather than remove anything
+                state.vlm_undo_stack.pop()
+                return "This example was already removed by another session"
+            if offset != offsets[-1]:
+                return "Another session saved an example after this one"
+            f.truncate(offset)
+            f.flush()
+            g = get_jsonl_writer(offsets_path)
+            with file_lock(g):
+                g.truncate((len(offsets) - 1) * 8)
+                g.flush()
+            _line_owners.pop((out_path, offset), None)
+    state.vlm_undo_stack.pop()
+    return None
+
+
+def release_line_owners(state: SessionState):
+    """Forget which lines a session saved, once it is gone."""
+    with _jsonl_lock:
+        for key in [key for key, owner in _line_owners.items() if owner is state]:
+            del _line_owners[key]
+
+
+def initialize_labeling(state: SessionState, mode: str, persona: str):
     """Initialize labeling session."""
-    global current_mode, current_persona, all_messages, all_messages_unfiltered, current_index, current_conversation, labeled_conversations, vlm_undo_stack
-    
-    current_mode = mode
-    current_persona = persona
+    state.current_mode = mode
+    state.current_persona = persona
+    state.progress_file = get_progress_file(persona, mode)
+    state.context_window_cache = {}
     
     if mode == "vlm":
         # Load all messages for context, but filter to image messages for labeling
-        persona_dir = VLM_CLEANED_DIR / persona
-        data_file = persona_dir / f"{persona}.json"
-        with open(data_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        all_messages_unfiltered = data.get("messages", [])
+        state.all_messages_unfiltered = load_vlm_cleaned_data(persona)
         
         # Normalize roles from sender: persona -> "user", YOUR_NAME -> "assistant"
-        for m in all_messages_unfiltered:
-            sender = (m.get("sender") or "").strip()
-            if sender and sender == YOUR_NAME:
-                m["role"] = "assistant"
-            else:
-                m["role"] = "user"
-
-        all_messages = [msg for msg in all_messages_unfiltered if msg.get("image")]
-        logger.info(f"Loaded {len(all_messages_unfiltered)} total messages, {len(all_messages)} with images")
-        # Initialize undo stack from existing persona file if present
-        vlm_undo_stack = []
+        role_for = {YOUR_NAME: "assistant"} if YOUR_NAME else {}
+        for m in state.all_messages_unfiltered:
+            m["role"] = role_for.get((m.get("sender") or "").strip(), "user")
+
+        # Index each image message by its first (image, timestamp) occurrence in the
+        # unfiltered list, so the context endpoints don't have to search for it
+        state.all_messages = []
+        state.image_unfiltered_positions = []
+        first_seen = {}
+        for idx, msg in enumerate(state.all_messages_unfiltered):
+            if msg.get("image"):
+                state.all_messages.append(msg)
+                state.image_unfiltered_positions.append(
+                    first_seen.setdefault((msg["image"], msg.get("timestamp")), idx)
+                )
+        logger.info(f"Loaded {len(state.all_messages_unfiltered)} total messages, {len(state.all_messages)} with images")
+        # Initialize undo stack from existing persona file if present (line offsets only, no parsing)
+        state.vlm_undo_stack = []
         existing_path = get_vlm_output_file(persona)
         if existing_path.exists():
-            with open(existing_path, "r", encoding="utf-8") as f:
-                vlm_undo_stack = [json.loads(line) for line in f if line.strip()]
+            with _jsonl_lock:
+                state.vlm_undo_stack = [
+                    offset for offset in load_line_offsets(existing_path)
+                    if _line_owners.get((existing_path, offset), state) is state
+                ]
+        else:
+            offsets_path = get_offsets_file(existing_path)
+            close_jsonl_writer(offsets_path)
+            offsets_path.unlink(missing_ok=True)
     else:
-        all_messages = load_cleaned_messages(persona)
-        all_messages_unfiltered = []
+        state.all_messages = load_cleaned_messages(persona)
+        state.all_messages_unfiltered = []
+        state.image_unfiltered_positions = []
     
     # Try to resume from progress
-    progress = load_progress(persona)
-    current_index = progress["current_index"]
+    progress = load_progress(persona, mode)
+    state.current_index = progress["current_index"]
     
-    # Only load labeled_conversations for core mode
+    # Only load labeled counts for core mode
     if mode != "vlm":
-        labeled_conversations = progress.get("labeled_conversations", [])
-        if current_index > 0 or labeled_conversations:
-            logger.info(f"Resumed from index {current_index} with {len(labeled_conversations)} conversations")
+        if "labeled_conversations" in progress:
+            # Older progress files kept every labeled conversation
+            labeled_conversations = progress["labeled_conversations"]
+            state.labeled_count = len(labeled_conversations)
+            state.labeled_message_count = sum(len(conv) for conv in labeled_conversations)
+        else:
+            state.labeled_count = progress.get("labeled_count", 0)
+            state.labeled_message_count = progress.get("labeled_message_count", 0)
+        if state.current_index > 0 or state.labeled_count:
+            logger.info(f"Resumed from index {state.current_index} with {state.labeled_count} conversations")
         else:
             logger.info("Starting fresh labeling session")
     else:
-        if current_index > 0:
-            logger.info(f"Resumed VLM labeling from image {current_index}")
+        if state.current_index > 0:
+            logger.info(f"Resumed VLM labeling from image {state.current_index}")
         else:
             logger.info("Starting fresh VLM labeling session")
     
-    current_conversation = []
+    state.current_conversation = []
 
 
 # --- AUTHENTICATION HELPER ---
@@ -277,12 +507,54 @@ def require_login(f):
     return decorated_function
 
 
+def get_session_state() -> SessionState:
+    """Return the labelling state of the current Flask session, creating it if needed."""
+    sid = session.get("sid")
+    if sid is None:
+        sid = session["sid"] = uuid.uuid4().hex
+    now = time.monotonic()
+    with _sessions_lock:
+        expired = [
+            key for key, state in SESSIONS.items()
+            if key != sid and now - state.last_seen > SESSION_IDLE_TIMEOUT_SECONDS
+        ]
+        expired_states = [SESSIONS.pop(key) for key in expired]
+        state = SESSIONS.setdefault(sid, SessionState())
+        state.last_seen = now
+    for expired_state in expired_states:
+        release_line_owners(expired_state)
+    if expired:
+        logger.info(f"Evicted {len(expired)} idle labelling sessions")
+    return state
+
+
+# --- JSON PROVIDER ---
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes jsonify() and parses request bodies with orjson."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_SORT_KEYS if kwargs.get("sort_keys", self.sort_keys) else 0
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
 # --- FLASK APP FACTORY ---
 def create_app() -> Flask:
     """Create and configure Flask app."""
     app = Flask(__name__, template_folder="templates", static_folder="static")
+    app.json = OrjsonProvider(app)
     app.config["JSON_SORT_KEYS"] = False
     app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "labeling-secret-key-change-in-production")
+    # Let a fronting nginx/Apache stream image files itself (X-Sendfile)
+    app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "").lower() in ("1", "true")
     
     # Register routes
     @app.route("/login", methods=["GET", "POST"])
@@ -302,6 +574,10 @@ def create_app() -> Flask:
     @app.route("/logout", methods=["POST"])
     def logout():
         """Logout."""
+        with _sessions_lock:
+            state = SESSIONS.pop(session.get("sid"), None)
+        if state is not None:
+            release_line_owners(state)
         session.clear()
         logger.info("User logged out")
         return redirect(url_for("login"))
@@ -330,7 +606,9 @@ def create_app() -> Flask:
             
             try:
                 mode = session.get("mode", "manual")
-                initialize_labeling(mode, persona)
+                state = get_session_state()
+                with state.lock:
+                    initialize_labeling(state, mode, persona)
                 return redirect(url_for("index"))
             except FileNotFoundError as e:
                 return render_template("select_persona.html", error=str(e))
@@ -341,187 +619,200 @@ def create_app() -> Flask:
     @require_login
     def index():
         """Main labeling interface."""
-        if not current_persona:
+        state = get_session_state()
+        
+        if not state.current_persona:
             return redirect(url_for("select_mode"))
         
-        if current_mode == "vlm":
-            return render_template("vlm_labeler.html", persona=current_persona)
+        if state.current_mode == "vlm":
+            return render_template("vlm_labeler.html", persona=state.current_persona)
         else:
-            return render_template("labeler.html", persona=current_persona, mode=current_mode)
+            return render_template("labeler.html", persona=state.current_persona, mode=state.current_mode)
 
     @app.route("/api/next-message", methods=["GET"])
     @require_login
     def api_next_message():
         """Get the next message to label."""
-        if current_index >= len(all_messages):
+        state = get_session_state()
+        
+        if state.current_index >= len(state.all_messages):
             return jsonify({
                 "done": True,
                 "message": "All messages labeled!",
-                "total_labeled": len(labeled_conversations)
+                "total_labeled": state.labeled_count
             })
         
-        msg = all_messages[current_index]
+        msg = state.all_messages[state.current_index]
         
         return jsonify({
             "done": False,
-            "index": current_index,
-            "total": len(all_messages),
+            "index": state.current_index,
+            "total": len(state.all_messages),
             "message": {
                 "timestamp": msg["timestamp"],
                 "sender": msg["sender"],
                 "content": msg["message"]
             },
-            "conversation_size": len(current_conversation) + 1,
-            "labeled_count": len(labeled_conversations)
+            "conversation_size": len(state.current_conversation) + 1,
+            "labeled_count": state.labeled_count
         })
 
     @app.route("/api/add-to-conversation", methods=["POST"])
     @require_login
     def api_add_to_conversation():
         """Add current message to conversation."""
-        global current_conversation, current_index
+        state = get_session_state()
         
-        if current_index >= len(all_messages):
-            return jsonify({"error": "No message to add"}), 400
+        with state.lock:
+            if state.current_index >= len(state.all_messages):
+                return jsonify({"error": "No message to add"}), 400
         
-        current_conversation.append(all_messages[current_index])
-        current_index += 1
+            state.current_conversation.append(state.all_messages[state.current_index])
+            state.current_index += 1
         
-        return jsonify({
-            "success": True,
-            "conversation_size": len(current_conversation),
-            "current_index": current_index
-        })
+            return jsonify({
+                "success": True,
+                "conversation_size": len(state.current_conversation),
+                "current_index": state.current_index
+            })
 
     @app.route("/api/end-conversation", methods=["POST"])
     @require_login
     def api_end_conversation():
         """End conversation and save it."""
-        global current_conversation, labeled_conversations
+        state = get_session_state()
         
-        if len(current_conversation) == 0:
-            return jsonify({"error": "No messages in conversation"}), 400
+        with state.lock:
+            if len(state.current_conversation) == 0:
+                return jsonify({"error": "No messages in conversation"}), 400
         
-        save_labeled_conversation(current_conversation, current_persona)
-        labeled_conversations.append(current_conversation.copy())
-        current_conversation = []
+            save_labeled_conversation(state.current_conversation, state.current_persona)
+            state.labeled_count += 1
+            state.labeled_message_count += len(state.current_conversation)
+            state.current_conversation = []
         
-        save_progress()
+            save_progress(state)
         
-        return jsonify({
-            "success": True,
-            "labeled_count": len(labeled_conversations)
-        })
+            return jsonify({
+                "success": True,
+                "labeled_count": state.labeled_count
+            })
 
     @app.route("/api/undo", methods=["POST"])
     @require_login
     def api_undo():
         """Undo last message addition."""
-        global current_index, current_conversation
+        state = get_session_state()
         
-        if len(current_conversation) == 0:
-            return jsonify({"error": "Nothing to undo"}), 400
+        with state.lock:
+            if len(state.current_conversation) == 0:
+                return jsonify({"error": "Nothing to undo"}), 400
         
-        current_conversation.pop()
-        current_index -= 1
+            state.current_conversation.pop()
+            state.current_index -= 1
         
-        return jsonify({
-            "success": True,
-            "current_index": current_index,
-            "conversation_size": len(current_conversation)
-        })
+            return jsonify({
+                "success": True,
+                "current_index": state.current_index,
+                "conversation_size": len(state.current_conversation)
+            })
 
     @app.route("/api/skip-message", methods=["POST"])
     @require_login
     def api_skip_message():
         """Skip current message."""
-        global current_index
+        state = get_session_state()
         
-        if current_index >= len(all_messages):
-            return jsonify({"error": "No more messages"}), 400
+        with state.lock:
+            if state.current_index >= len(state.all_messages):
+                return jsonify({"error": "No more messages"}), 400
         
-        current_index += 1
+            state.current_index += 1
         
-        return jsonify({
-            "success": True,
-            "current_index": current_index,
-            "total": len(all_messages)
-        })
+            return jsonify({
+                "success": True,
+                "current_index": state.current_index,
+                "total": len(state.all_messages)
+            })
 
     @app.route("/api/stats", methods=["GET"])
     @require_login
     def api_stats():
         """Get labeling statistics."""
+        state = get_session_state()
+        
         return jsonify({
-            "mode": current_mode,
-            "persona": current_persona,
-            "total_messages": len(all_messages),
-            "labeled_messages": sum(len(conv) for conv in labeled_conversations),
-            "labeled_conversations": len(labeled_conversations),
-            "current_index": current_index,
-            "progress_percent": round((current_index / len(all_messages) * 100) if all_messages else 0, 1)
+            "mode": state.current_mode,
+            "persona": state.current_persona,
+            "total_messages": len(state.all_messages),
+            "labeled_messages": state.labeled_message_count,
+            "labeled_conversations": state.labeled_count,
+            "current_index": state.current_index,
+            "progress_percent": round((state.current_index / len(state.all_messages) * 100) if state.all_messages else 0, 1)
         })
 
     @app.route("/api/vlm/image/<persona>/<filename>")
     @require_login
     def api_vlm_image(persona: str, filename: str):
         """Serve VLM image file."""
-        from flask import send_file
-        image_path = VLM_CLEANED_DIR / persona / "images" / filename
-        if not image_path.exists():
+        from flask import send_from_directory
+        # Exported images never change under the same name, so let the browser
+        # cache them for a year and revalidate with conditional requests
+        try:
+            return send_from_directory(
+                VLM_CLEANED_DIR / persona / "images", filename,
+                mimetype='image/jpeg', max_age=31536000, conditional=True
+            )
+        except NotFound:
             return jsonify({"error": "Image not found"}), 404
-        return send_file(image_path, mimetype='image/jpeg')
 
     @app.route("/api/vlm/context-window", methods=["GET"])
     @require_login
     def api_vlm_context_window():
         """Get context window around current image message with ±20 messages."""
-        if current_mode != "vlm" or current_index >= len(all_messages):
-            return jsonify({"error": "Invalid request"}), 400
+        state = get_session_state()
         
-        image_msg = all_messages[current_index]
+        if state.current_mode != "vlm" or state.current_index >= len(state.all_messages):
+            return jsonify({"error": "Invalid request"}), 400
         
-        # Find the position of this image message in the unfiltered list
-        unfiltered_idx = None
-        for idx, msg in enumerate(all_messages_unfiltered):
-            if msg.get("image") == image_msg.get("image") and msg.get("timestamp") == image_msg.get("timestamp"):
-                unfiltered_idx = idx
-                break
+        # The window only depends on the image index, so going back to an image
+        # (undo, reload) reuses the serialized response
+        body = state.context_window_cache.get(state.current_index)
+        if body is not None:
+            return app.response_class(body, mimetype=app.json.mimetype)
         
-        if unfiltered_idx is None:
-            # Fallback: search by image filename only
-            for idx, msg in enumerate(all_messages_unfiltered):
-                if msg.get("image") == image_msg.get("image"):
-                    unfiltered_idx = idx
-                    break
+        image_msg = state.all_messages[state.current_index]
         
-        if unfiltered_idx is None:
-            # Last resort: use current_index as approximation
-            unfiltered_idx = current_index
+        # Position of this image message in the unfiltered list
+        unfiltered_idx = state.image_unfiltered_positions[state.current_index]
         
         # Get ±50 messages around the image to ensure at least 20+ available for selection
         context_size = 50
         start_idx = max(0, unfiltered_idx - context_size)
-        end_idx = min(len(all_messages_unfiltered), unfiltered_idx + context_size + 1)
+        end_idx = min(len(state.all_messages_unfiltered), unfiltered_idx + context_size + 1)
         
-        preceding = all_messages_unfiltered[start_idx:unfiltered_idx]
-        following = all_messages_unfiltered[unfiltered_idx + 1:end_idx]
+        preceding = state.all_messages_unfiltered[start_idx:unfiltered_idx]
+        following = state.all_messages_unfiltered[unfiltered_idx + 1:end_idx]
         
-        return jsonify({
+        response = jsonify({
             "preceding": preceding,
             "image_message": image_msg,
             "following": following,
             "unfiltered_idx": unfiltered_idx,
-            "total_unfiltered": len(all_messages_unfiltered),
-            "current_index": current_index,
-            "total_images": len(all_messages)
+            "total_unfiltered": len(state.all_messages_unfiltered),
+            "current_index": state.current_index,
+            "total_images": len(state.all_messages)
         })
+        if len(state.context_window_cache) >= CONTEXT_WINDOW_CACHE_SIZE:
+            del state.context_window_cache[next(iter(state.context_window_cache))]
+        state.context_window_cache[state.current_index] = response.get_data()
+        return response
 
     @app.route("/api/vlm/save-example", methods=["POST"])
     @require_login
     def api_vlm_save_example():
         """Save a VLM training example."""
-        global current_index, labeled_conversations
+        state = get_session_state()
         
         data = request.get_json()
         if not data:
@@ -530,95 +821,83 @@ def create_app() -> Flask:
         example = {
             "images": data.get("images", []),
             "messages": data.get("messages", []),
-            "persona": current_persona,
+            "persona": state.current_persona,
             "timestamp": data.get("timestamp")
         }
         
-        save_vlm_labeled_example(example, current_persona)
-        labeled_conversations.append(example)
-        current_index += 1
-        save_progress()
+        with state.lock:
+            save_vlm_labeled_example(state, example)
+            state.labeled_count += 1
+            state.labeled_message_count += len(example)
+            state.current_index += 1
+            save_progress(state)
         
-        return jsonify({
-            "success": True,
-            "labeled_count": len(labeled_conversations),
-            "current_index": current_index
-        })
+            return jsonify({
+                "success": True,
+                "labeled_count": state.labeled_count,
+                "current_index": state.current_index
+            })
 
     @app.route("/api/vlm/skip-image", methods=["POST"])
     @require_login
     def api_vlm_skip_image():
         """Skip current image."""
-        global current_index
+        state = get_session_state()
         
-        if current_index >= len(all_messages):
-            return jsonify({"error": "No more images"}), 400
+        with state.lock:
+            if state.current_index >= len(state.all_messages):
+                return jsonify({"error": "No more images"}), 400
         
-        current_index += 1
-        save_progress()
+            state.current_index += 1
+            save_progress(state)
         
-        return jsonify({"success": True})
+            return jsonify({"success": True})
 
     @app.route("/api/vlm/undo", methods=["POST"])
     @require_login
     def api_vlm_undo():
         """Undo the last labeled example."""
-        global vlm_undo_stack, current_index
-        
-        if not vlm_undo_stack:
-            return jsonify({"error": "Nothing to undo"}), 400
+        state = get_session_state()
         
-        # Remove last example from undo stack
-        vlm_undo_stack.pop()
+        with state.lock:
+            if not state.vlm_undo_stack:
+                return jsonify({"error": "Nothing to undo"}), 400
         
-        # Rewrite the JSONL file without the last example
-        out_path = get_vlm_output_file(current_persona)
-        with open(out_path, "w", encoding="utf-8") as f:
-            for example in vlm_undo_stack:
-                f.write(json.dumps(example, ensure_ascii=False) + "\n")
+            # Truncate the JSONL file back to where this session's last example started
+            error = undo_vlm_labeled_example(state)
+            if error is not None:
+                logger.warning(f"Undo refused for {state.current_persona}: {error}")
+                return jsonify({"error": error, "undo_stack_size": len(state.vlm_undo_stack)}), 409
         
-        # Move back one image (undo the increment)
-        if current_index > 0:
-            current_index -= 1
+            # Move back one image (undo the increment)
+            if state.current_index > 0:
+                state.current_index -= 1
         
-        save_progress()
-        logger.info(f"Undone last example. Undo stack size: {len(vlm_undo_stack)}")
+            save_progress(state)
+            logger.info(f"Undone last example. Undo stack size: {len(state.vlm_undo_stack)}")
         
-        return jsonify({
-            "success": True,
-            "undo_stack_size": len(vlm_undo_stack),
-            "current_index": current_index
-        })
+            return jsonify({
+                "success": True,
+                "undo_stack_size": len(state.vlm_undo_stack),
+                "current_index": state.current_index
+            })
 
     @app.route("/api/vlm/load-more-before", methods=["GET"])
     @require_login
     def api_vlm_load_more_before():
         """Load more messages before the current context window."""
-        if current_mode != "vlm" or current_index >= len(all_messages):
-            return jsonify({"error": "Invalid request"}), 400
-        
-        image_msg = all_messages[current_index]
-        
-        # Find the position of this image message in the unfiltered list
-        unfiltered_idx = None
-        for idx, msg in enumerate(all_messages_unfiltered):
-            if msg.get("image") == image_msg.get("image") and msg.get("timestamp") == image_msg.get("timestamp"):
-                unfiltered_idx = idx
-                break
+        state = get_session_state()
         
-        if unfiltered_idx is None:
-            for idx, msg in enumerate(all_messages_unfiltered):
-                if msg.get("image") == image_msg.get("image"):
-                    unfiltered_idx = idx
-                    break
+        if state.current_mode != "vlm" or state.current_index >= len(state.all_messages):
+            return jsonify({"error": "Invalid request"}), 400
         
-        if unfiltered_idx is None:
-            unfiltered_idx = current_index
+        # Position of this image message in the unfiltered list
+        unfiltered_idx = state.image_unfiltered_positions[state.current_index]
         
         # Load 20 more messages before
         context_size = 40  # Expand window
         start_idx = max(0, unfiltered_idx - context_size)
-        preceding = all_messages_unfiltered[start_idx:unfiltered_idx]
+        preceding = state.all_messages_unfiltered[start_idx:unfiltered_idx]
         
         return jsonify({
             "preceding": preceding,
@@ -629,31 +908,18 @@ def create_app() -> Flask:
     @require_login
     def api_vlm_load_more_after():
         """Load more messages after the current context window."""
-        if current_mode != "vlm" or current_index >= len(all_messages):
-            return jsonify({"error": "Invalid request"}), 400
-        
-        image_msg = all_messages[current_index]
+        state = get_session_state()
         
-        # Find the position of this image message in the unfiltered list
-        unfiltered_idx = None
-        for idx, msg in enumerate(all_messages_unfiltered):
-            if msg.get("image") == image_msg.get("image") and msg.get("timestamp") == image_msg.get("timestamp"):
-                unfiltered_idx = idx
-                break
-        
-        if unfiltered_idx is None:
-            for idx, msg in enumerate(all_messages_unfiltered):
-                if msg.get("image") == image_msg.get("image"):
-                    unfiltered_idx = idx
-                    break
+        if state.current_mode != "vlm" or state.current_index >= len(state.all_messages):
+            return jsonify({"error": "Invalid request"}), 400
         
-        if unfiltered_idx is None:
-            unfiltered_idx = current_index
+        # Position of this image message in the unfiltered list
+        unfiltered_idx = state.image_unfiltered_positions[state.current_index]
         
         # Load 20 more messages after
         context_size = 40  # Expand window
-        end_idx = min(len(all_messages_unfiltered), unfiltered_idx + context_size + 1)
-        following = all_messages_unfiltered[unfiltered_idx + 1:end_idx]
+        end_idx = min(len(state.all_messages_unfiltered), unfiltered_idx + context_size + 1)
+        following = state.all_messages_unfiltered[unfiltered_idx + 1:end_idx]
         
         return jsonify({
             "following": following,
@@ -5,16 +5,43 @@ Input:  datasets/core/chats_processed/<persona>.jsonl
 Output: datasets/core/chats_processed/conversations.jsonl
 """
 
+import heapq
 import json
 from pathlib import Path
+from typing import Iterator, Tuple
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback; orjson is only a speedup
+    orjson = None
 
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 PROCESSED_DIR = PROJECT_ROOT / "datasets" / "core" / "chats_processed"
+OUTPUT_FILE = PROCESSED_DIR / "conversations.jsonl"
+
+
+def count_conversations(persona_file: Path) -> int:
+    """Count non-empty lines without parsing them."""
+    with open(persona_file, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def iter_keyed_lines(persona_file: Path) -> Iterator[Tuple[Tuple[str, str], bytes]]:
+    """Yield ((persona, timestamp_start), raw line) for each conversation in a file."""
+    with open(persona_file, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            conv = orjson.loads(line) if orjson is not None else json.loads(line)
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            yield (conv["persona"], conv["timestamp_start"]), line
 
 
 def combine_personas():
     """Combine all persona-specific JSONL files into a single training file."""
-    persona_files = sorted(PROCESSED_DIR.glob("*.jsonl"))
+    # The combined output lives in the same directory; never read it back in
+    persona_files = sorted(p for p in PROCESSED_DIR.glob("*.jsonl") if p != OUTPUT_FILE)
     
     if not persona_files:
         print(f"Error: No persona JSONL files found in {PROCESSED_DIR}")
@@ -24,38 +51,30 @@ def combine_personas():
     for f in persona_files:
         print(f"  - {f.name}")
     
-    all_conversations = []
+    total = 0
     
     for persona_file in persona_files:
         print(f"\nReading {persona_file.name}...")
-        with open(persona_file, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    conv = json.loads(line)
-                    all_conversations.append(conv)
-        print(f"  Loaded {len(all_conversations)} conversations so far")
+        total += count_conversations(persona_file)
+        print(f"  Loaded {total} conversations so far")
     
-    if not all_conversations:
+    if not total:
         print("No conversations found.")
         return
     
-    # Sort by persona, then by timestamp
-    all_conversations.sort(key=lambda c: (c["persona"], c["timestamp_start"]))
-    
-    # Save combined file
-    output_file = PROCESSED_DIR / "conversations.jsonl"
-    with open(output_file, "w", encoding="utf-8") as f:
-        for conv in all_conversations:
-            f.write(json.dumps(conv, ensure_ascii=False) + "\n")
+    # Sort by persona, then by timestamp. Each persona file is written in
+    # timestamp order by process/core.py, so a streaming k-way merge gives the
+    # same order as a full sort; lines are copied through without re-encoding.
+    personas = {}
+    with open(OUTPUT_FILE, "wb") as f:
+        merged = heapq.merge(*map(iter_keyed_lines, persona_files), key=lambda item: item[0])
+        for (persona, _), line in merged:
+            f.write(line)
+            personas[persona] = personas.get(persona, 0) + 1
     
-    print(f"\n✅ Combined {len(all_conversations)} conversations into {output_file}")
+    print(f"\n✅ Combined {total} conversations into {OUTPUT_FILE}")
     
     # Print summary stats
-    personas = {}
-    for conv in all_conversations:
-        persona = conv["persona"]
-        personas[persona] = personas.get(persona, 0) + 1
-    
     print(f"\nSummary by persona:")
     for persona, count in sorted(personas.items()):
         print(f"  {persona}: {count} conversations")
@@ -7,14 +7,28 @@ Input:  datasets/core/chats_cleaned/<persona>.json
 Output: datasets/core/chats_processed/conversations.jsonl (ChatML format)
 """
 
+import hashlib
 import json
 import logging
 import os
+import re
 import sys
-from datetime import datetime
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple
+import ijson
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback; orjson is only a speedup
+    orjson = None
 
 # --- LOGGING CONFIG ---
 logging.basicConfig(
@@ -32,17 +46,56 @@ PROJECT_ROOT = Path(__file__).parent.parent.parent
 CLEANED_DIR = PROJECT_ROOT / "datasets" / "core" / "chats_cleaned"
 PROCESSED_DIR = PROJECT_ROOT / "datasets" / "core" / "chats_processed"
 PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+# Continuation answers memoized across runs, one small JSON file per prompt
+CACHE_DIR = PROCESSED_DIR / ".llm_cache"
 
 # --- CHUNKING CONFIG ---
 AUTO_GROUP_MINUTES = 15
 LLM_QUERY_MIN_MINUTES = 15
 LLM_QUERY_MAX_MINUTES = 240
-SLEEP_START_HOUR = 0
+SLEEP_START_HOUR = 0  # sleep hours are [start, end): 12am-10am
 SLEEP_END_HOUR = 10
 
+# Gap decisions computed by the classification pass of chunk_by_llm
+GAP_AUTO, GAP_ASK, GAP_SPLIT = 0, 1, 2
+
 # --- LLM CHUNKING CONFIG ---
 LLM_ENDPOINT = os.environ.get("LLM_ENDPOINT")
 LLM_MODEL = os.environ.get("LLM_MODEL")
+# Total LLM requests in flight, shared out between persona worker processes
+LLM_MAX_WORKERS = int(os.environ.get("LLM_MAX_WORKERS", "8"))
+# Continuation questions in flight per chat segment, including ones asked before
+# the earlier answers (which may move the chunk start) are known
+LLM_LOOKAHEAD = max(1, int(os.environ.get("LLM_LOOKAHEAD", "16")))
+
+# Static instructions sent first in every request, so servers with prefix caching
+# reuse their KV cache and only prefill the per-question conversation
+SYSTEM_PROMPT = """You are a conversation-boundary classifier for chat logs.
+You are shown the most recent messages of an ongoing conversation between User and Assistant, followed by a new message.
+Does this new message continue the same conversation, or does it start a new topic/conversation?
+Answer with exactly one character: Y (it continues the conversation) or N (it starts a new one)."""
+
+# A continuation answer starts with Y, possibly after whitespace, quotes or markdown
+_YES_RE = re.compile(r"""\s*["'*`]*y""", re.IGNORECASE)
+
+# Continuation questions are network-bound, so a batch is sent from a thread pool
+_LLM_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS)
+
+# One keep-alive session shared by all workers, with a connection per worker;
+# transient gateway errors are retried before falling back to time-based splits
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(
+    pool_connections=LLM_MAX_WORKERS,
+    pool_maxsize=LLM_MAX_WORKERS,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+))
+_SESSION.mount("https://", _SESSION.get_adapter("http://"))
 
 # --- TEST MODE CONFIG ---
 TEST_MODE = False
@@ -52,41 +105,87 @@ TEST_MESSAGE_LIMIT = 200
 YOUR_NAME = "Festus"
 
 
-def is_in_sleep_hours(dt: datetime) -> bool:
-    """Check if datetime is during sleep hours (12am-10am)."""
-    return SLEEP_START_HOUR <= dt.hour < SLEEP_END_HOUR
+def _dumps_line(conv: dict) -> bytes:
+    """Serialize one conversation as a UTF-8 JSONL line."""
+    if orjson is not None:
+        return orjson.dumps(conv, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(conv, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def render_context_line(msg: dict, first_sender: str) -> str:
+    """Render one message as a line of the LLM's conversation context."""
+    sender = "User" if msg["sender"] == first_sender else "Assistant"
+    return f"[{msg['timestamp']}] {sender}: {msg['message']}\n"
 
 
-def ask_llm_about_continuation(conversation_so_far: List[dict], new_message: dict) -> bool:
+def get_llm_cache_path(prompt: str) -> Path:
+    """Cache file for a prompt's answer, sharded by the first two hex digits of its key."""
+    key = hashlib.sha256(f"{LLM_MODEL}\0{SYSTEM_PROMPT}\0{prompt}".encode("utf-8")).hexdigest()[:24]
+    return CACHE_DIR / key[:2] / key
+
+
+def load_cached_answer(prompt: str) -> Optional[bool]:
+    """Return the cached answer for a prompt, or None if it was never answered."""
+    try:
+        with open(get_llm_cache_path(prompt), "r", encoding="utf-8") as f:
+            return json.load(f)["answer"]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable LLM cache entry: {e}")
+        return None
+
+
+def save_cached_answer(prompt: str, answer: bool) -> None:
+    """Persist an LLM answer; written via a temp file so readers never see a partial entry."""
+    cache_file = get_llm_cache_path(prompt)
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"answer": answer, "prompt": prompt}, f, ensure_ascii=False)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logger.warning(f"Could not write LLM cache entry: {e}")
+
+
+def ask_llm_about_continuation(context: str, new_message: dict, first_sender: str) -> bool:
     """
     Ask LLM if new_message continues the conversation.
     
+    context is the pre-rendered tail of the conversation (see render_context_line);
+    first_sender is the sender of the conversation's first message, who is "User".
     Returns True if message belongs to same conversation, False if new conversation.
     """
     try:
-        context = "Previous conversation:\n"
-        for msg in conversation_so_far[-10:]:
-            sender = "User" if msg["sender"] == conversation_so_far[0]["sender"] else "Assistant"
-            context += f"[{msg['timestamp']}] {sender}: {msg['message']}\n"
-        
-        context += f"\nNew message at [{new_message['timestamp']}]:\n"
-        sender = "User" if new_message["sender"] == conversation_so_far[0]["sender"] else "Assistant"
-        context += f"{sender}: {new_message['message']}\n"
+        # Only the conversation varies between questions; the instructions are in SYSTEM_PROMPT
+        sender = "User" if new_message["sender"] == first_sender else "Assistant"
+        prompt = (
+            f"Previous conversation:\n{context}"
+            f"\nNew message at [{new_message['timestamp']}]:\n"
+            f"{sender}: {new_message['message']}\n"
+        )
         
-        prompt = f"""{context}
-Does this new message continue the same conversation, or does it start a new topic/conversation?
-Answer with only "YES" or "NO"."""
+        cached = load_cached_answer(prompt)
+        if cached is not None:
+            logger.debug("LLM answer served from cache")
+            return cached
         
         logger.debug(f"Sending prompt to LLM: {prompt[:100]}...")
         logger.debug(f"LLM Endpoint: {LLM_ENDPOINT}")
         logger.debug(f"LLM Model: {LLM_MODEL}")
         
-        response = requests.post(
+        response = _SESSION.post(
             LLM_ENDPOINT,
             json={
                 "model": LLM_MODEL,
-                "messages": [{"role": "user", "content": prompt}],
-                "stream": False
+                "messages": [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+                "stream": False,
+                # The answer is one token; stop decoding there
+                "options": {"num_predict": 1, "temperature": 0},
             },
             timeout=30
         )
@@ -94,21 +193,35 @@ Answer with only "YES" or "NO"."""
         logger.debug(f"Response status: {response.status_code}")
         
         if response.status_code == 200:
-            result = response.json()
-            answer = result.get("message", {}).get("content", "").strip().upper()
-            logger.info(f"LLM answer: {answer}")
-            return "YES" in answer
+            result = orjson.loads(response.content) if orjson is not None else response.json()
+            answer = result.get("message", {}).get("content", "")
+            logger.info(f"LLM answer: {answer!r}")
+            should_continue = _YES_RE.match(answer) is not None
+            save_cached_answer(prompt, should_continue)
+            return should_continue
         else:
-            logger.error(f"LLM error: {response.status_code}")
-            logger.error(f"Response text: {response.text}")
-            print(f"LLM error: {response.status_code}, falling back to time-based decision")
+            logger.warning(
+                f"LLM error: {response.status_code}, falling back to time-based decision. "
+                f"Response text: {response.text}"
+            )
             return False
     except Exception as e:
-        logger.exception(f"LLM request failed: {e}")
-        print(f"LLM request failed: {e}, falling back to time-based decision")
+        logger.exception(f"LLM request failed: {e}, falling back to time-based decision")
         return False
 
 
+def ask_llm_about_continuation_batch(candidates: List[Tuple[str, dict, str]]) -> List[bool]:
+    """
+    Answer a batch of independent continuation questions.
+    
+    Each candidate is a (context, new_message, first_sender) triple, decided exactly
+    as ask_llm_about_continuation would; up to LLM_MAX_WORKERS are in flight at once.
+    """
+    if len(candidates) == 1:
+        return [ask_llm_about_continuation(*candidates[0])]
+    return list(_LLM_EXECUTOR.map(lambda candidate: ask_llm_about_continuation(*candidate), candidates))
+
+
 def chunk_by_llm(messages: List[dict]) -> List[List[dict]]:
     """
     Split messages into chunks using LLM with smart time-based heuristics.
@@ -126,47 +239,93 @@ def chunk_by_llm(messages: List[dict]) -> List[List[dict]]:
     if len(messages) < 2:
         return [messages]
     
-    chunks = []
-    current_chunk = [messages[0]]
-    
-    for i in range(1, len(messages)):
-        prev_msg = messages[i - 1]
-        curr_msg = messages[i]
-        
-        prev_time = datetime.fromisoformat(prev_msg["timestamp"])
-        curr_time = datetime.fromisoformat(curr_msg["timestamp"])
-        time_diff = curr_time - prev_time
-        time_diff_minutes = time_diff.total_seconds() / 60
-        
-        should_continue = False
-        
-        if time_diff_minutes < AUTO_GROUP_MINUTES:
-            should_continue = True
-        elif time_diff_minutes <= LLM_QUERY_MAX_MINUTES:
-            should_continue = ask_llm_about_continuation(current_chunk, curr_msg)
-        else:
-            if is_in_sleep_hours(curr_time):
-                should_continue = ask_llm_about_continuation(current_chunk, curr_msg)
-            else:
-                should_continue = False
-        
-        if should_continue:
-            current_chunk.append(curr_msg)
-        else:
-            chunks.append(current_chunk)
-            current_chunk = [curr_msg]
-    
-    if current_chunk:
-        chunks.append(current_chunk)
-    
-    return chunks
+    # Each ISO timestamp is parsed once, by NumPy, and shared by the gaps on
+    # either side of it
+    times = np.array([msg["timestamp"] for msg in messages], dtype="datetime64[us]")
+    
+    # Pass 1: classify the gap before each message (auto-group, ask LLM, force split)
+    gaps = np.diff(times)
+    hours = (times[1:] - times[1:].astype("datetime64[D]")) // np.timedelta64(1, "h")
+    in_sleep_hours = (hours >= SLEEP_START_HOUR) & (hours < SLEEP_END_HOUR)
+    decision = np.where(
+        gaps < np.timedelta64(AUTO_GROUP_MINUTES, "m"),
+        GAP_AUTO,
+        np.where(
+            (gaps <= np.timedelta64(LLM_QUERY_MAX_MINUTES, "m")) | in_sleep_hours,
+            GAP_ASK,
+            GAP_SPLIT,
+        ),
+    ).astype(np.int8)
+    splits = (np.flatnonzero(decision == GAP_SPLIT) + 1).tolist()
+    ask_indices = (np.flatnonzero(decision == GAP_ASK) + 1).tolist()
+    
+    # Pass 2: resolve the LLM gaps. Forced splits cut the chat into segments that
+    # chunk independently. Inside a segment each answer can move the chunk start
+    # (and so the next question's context), so every round asks the next open
+    # question of each segment in one batch, plus lookahead questions whose
+    # answers are kept only if their prompt turns out to be the one asked.
+    segments = []  # [current chunk start, pending ask indices]
+    bounds = [0] + splits + [len(messages)]
+    pending = deque(ask_indices)
+    for start, end in zip(bounds, bounds[1:]):
+        segment_asks = deque()
+        while pending and pending[0] < end:
+            segment_asks.append(pending.popleft())
+        if segment_asks:
+            segments.append([start, segment_asks])
+    
+    # The prompt shows the last 10 messages of the current chunk. Each line is
+    # rendered once and reused by every later question whose window covers it;
+    # the role label depends on the chunk's first sender, so it is part of the key.
+    rendered = {}
+    
+    def build_context(chunk_start: int, i: int) -> Tuple[str, dict, str]:
+        first_sender = messages[chunk_start]["sender"]
+        lines = []
+        for j in range(max(chunk_start, i - 10), i):
+            key = (j, messages[j]["sender"] == first_sender)
+            line = rendered.get(key)
+            if line is None:
+                line = rendered[key] = render_context_line(messages[j], first_sender)
+            lines.append(line)
+        return "".join(lines), messages[i], first_sender
+    
+    while segments:
+        # The next open question of every segment, then, while workers would
+        # otherwise sit idle, later ones asked as if none of the earlier ones
+        # splits (up to LLM_LOOKAHEAD questions per segment in all)
+        batch = []
+        for depth in range(LLM_LOOKAHEAD):
+            if depth and len(batch) >= LLM_MAX_WORKERS:
+                break
+            for segment in segments:
+                if depth < len(segment[1]) and (not depth or len(batch) < LLM_MAX_WORKERS):
+                    i = segment[1][depth]
+                    batch.append((segment, i, segment[0], build_context(segment[0], i)))
+        answers = ask_llm_about_continuation_batch([candidate for *_, candidate in batch])
+        for (segment, i, asked_start, candidate), should_continue in zip(batch, answers):
+            if not segment[1] or segment[1][0] != i:
+                continue  # an earlier lookahead answer in this segment was discarded
+            # A split earlier in this round moved the chunk start; the lookahead
+            # answer still stands if the prompt it was given is unchanged
+            if segment[0] != asked_start and build_context(segment[0], i) != candidate:
+                continue
+            segment[1].popleft()
+            if not should_continue:
+                splits.append(i)
+                segment[0] = i
+        segments = [segment for segment in segments if segment[1]]
+    
+    splits.sort()
+    bounds = [0] + splits + [len(messages)]
+    return [messages[start:end] for start, end in zip(bounds, bounds[1:])]
 
 
 def chunk_to_chatml(chunk: List[dict], persona: str) -> Optional[dict]:
     """
     Convert a chunk (list of messages) to ChatML format.
     
-    Role assignment:
+    Role assignment (precomputed per message as "_role" by process_cleaned_file):
     - YOUR_NAME is always "assistant"
     - Other person is always "user"
     
@@ -180,25 +339,20 @@ def chunk_to_chatml(chunk: List[dict], persona: str) -> Optional[dict]:
     if len(chunk) < 2:
         return None
     
-    # Trim leading assistant messages until we find a user message
-    start_idx = 0
-    for i, msg in enumerate(chunk):
-        if msg["sender"] != YOUR_NAME:
-            start_idx = i
-            break
-    else:
-        logger.debug(f"Skipping chunk: no user messages found.")
-        return None
-    
-    chunk = chunk[start_idx:]
-    
-    # Merge consecutive messages from same sender
+    # One pass: skip leading assistant messages, then merge consecutive messages
+    # from the same sender while noting whether the assistant ever speaks
     merged_messages = []
     current_role = None
     current_content = []
+    start_idx = 0
+    has_assistant = False
     
-    for msg in chunk:
-        role = "assistant" if msg["sender"] == YOUR_NAME else "user"
+    for i, msg in enumerate(chunk):
+        role = msg["_role"]
+        if role == "assistant":
+            if current_role is None:
+                continue
+            has_assistant = True
         
         if role == current_role:
             current_content.append(msg["message"])
@@ -208,85 +362,110 @@ def chunk_to_chatml(chunk: List[dict], persona: str) -> Optional[dict]:
                     "role": current_role,
                     "content": "\n".join(current_content),
                 })
+            else:
+                start_idx = i
             current_role = role
             current_content = [msg["message"]]
     
-    # Append final message
-    if current_role is not None:
-        merged_messages.append({
-            "role": current_role,
-            "content": "\n".join(current_content),
-        })
+    if current_role is None:
+        logger.debug(f"Skipping chunk: no user messages found.")
+        return None
     
     # Skip chunks with no assistant messages
-    has_assistant = any(msg["role"] == "assistant" for msg in merged_messages)
     if not has_assistant:
         logger.debug(f"Skipping chunk: no assistant messages.")
         return None
     
+    # Append final message
+    merged_messages.append({
+        "role": current_role,
+        "content": "\n".join(current_content),
+    })
+    
     return {
         "messages": merged_messages,
         "persona": persona,
-        "timestamp_start": chunk[0]["timestamp"],
+        "timestamp_start": chunk[start_idx]["timestamp"],
         "timestamp_end": chunk[-1]["timestamp"],
     }
 
 
-def process_cleaned_file(filepath: Path) -> List[dict]:
+def process_cleaned_file(filepath: Path) -> int:
     """
     Load cleaned JSON, chunk by LLM, and convert to ChatML format.
     Persona is inferred from filename (e.g., sister.json -> "sister").
-    Saves conversations to persona-specific JSONL file.
+    Streams conversations to persona-specific JSONL file and returns how many were written.
     """
-    print(f"Processing {filepath.name} ...")
+    logger.info(f"Processing {filepath.name} ...")
     
     persona = filepath.stem.lower()
     
-    # Load cleaned messages
-    with open(filepath, "r", encoding="utf-8") as f:
-        messages = json.load(f)
+    # Load cleaned messages, streamed one array item at a time so the raw file
+    # is never held in memory alongside the parsed list
+    with open(filepath, "rb") as f:
+        messages = list(ijson.items(f, "item"))
     
     if not messages:
-        print(f"No messages found.")
-        return []
+        logger.info(f"No messages found.")
+        return 0
     
-    print(f"Loaded {len(messages)} total messages")
+    logger.info(f"Loaded {len(messages)} total messages")
+    
+    # Tag each message's ChatML role once; interned senders make the remaining
+    # sender comparisons (prompt roles) identity checks
+    for msg in messages:
+        msg["sender"] = sys.intern(msg["sender"])
+        msg["_role"] = "assistant" if msg["sender"] == YOUR_NAME else "user"
     
     # TEST MODE: Limit messages for quick testing
     if TEST_MODE:
         messages = messages[:TEST_MESSAGE_LIMIT]
-        print(f"\n{'='*60}")
-        print(f"TEST MODE: Processing only first {len(messages)} messages")
-        print(f"{'='*60}")
-        print("\nMessage List:")
+        # The message list is assembled first and written to stdout in one go
+        lines = [
+            f"\n{'='*60}",
+            f"TEST MODE: Processing only first {len(messages)} messages",
+            f"{'='*60}",
+            "\nMessage List:",
+        ]
         for idx, msg in enumerate(messages, 1):
-            print(f"\n{idx}. [{msg['timestamp']}] {msg['sender']}")
-            print(f"   Message: {msg['message'][:80]}{'...' if len(msg['message']) > 80 else ''}")
-        print(f"\n{'='*60}\n")
+            lines.append(f"\n{idx}. [{msg['timestamp']}] {msg['sender']}")
+            lines.append(f"   Message: {msg['message'][:80]}{'...' if len(msg['message']) > 80 else ''}")
+        lines.append(f"\n{'='*60}\n")
+        sys.stdout.write("\n".join(lines) + "\n")
     
     # Chunk by LLM with smart time-based heuristics
-    messages.sort(key=lambda m: m["timestamp"])
+    # Timsort is linear on the already-ordered exports, so no sortedness pre-check
+    messages.sort(key=itemgetter("timestamp"))
     chunks = chunk_by_llm(messages)
-    print(f"Split into {len(chunks)} conversation chunks (LLM + time-based)")
-    
-    # Convert to ChatML
-    chatml_conversations = []
-    for chunk in chunks:
-        conv = chunk_to_chatml(chunk, persona)
-        if conv:
-            chatml_conversations.append(conv)
+    logger.info(f"Split into {len(chunks)} conversation chunks (LLM + time-based)")
     
-    print(f"Converted to {len(chatml_conversations)} ChatML conversations")
-    
-    # Save to persona-specific JSONL file
+    # Convert to ChatML, writing each conversation to the persona-specific JSONL file
     persona_output_file = PROCESSED_DIR / f"{persona}.jsonl"
-    with open(persona_output_file, "w", encoding="utf-8") as f:
-        for conv in chatml_conversations:
-            f.write(json.dumps(conv, ensure_ascii=False) + "\n")
-    
-    print(f"Saved to {persona_output_file}")
-    
-    return chatml_conversations
+    conversation_count = 0
+    with open(persona_output_file, "wb") as f:
+        for chunk in chunks:
+            conv = chunk_to_chatml(chunk, persona)
+            if conv:
+                f.write(_dumps_line(conv))
+                conversation_count += 1
+    
+    logger.info(f"Converted to {conversation_count} ChatML conversations")
+    logger.info(f"Saved to {persona_output_file}")
+    
+    return conversation_count
+
+
+def init_worker(test_mode: bool, llm_max_workers: int) -> None:
+    """
+    Carry the --test flag into worker processes (not inherited under spawn) and
+    give each its share of LLM_MAX_WORKERS, so all processes together never have
+    more requests in flight than a single process would.
+    """
+    global TEST_MODE, LLM_MAX_WORKERS, _LLM_EXECUTOR
+    TEST_MODE = test_mode
+    LLM_MAX_WORKERS = llm_max_workers
+    _LLM_EXECUTOR.shutdown(wait=False)
+    _LLM_EXECUTOR = ThreadPoolExecutor(max_workers=llm_max_workers)
 
 
 def main():
@@ -302,47 +481,51 @@ def main():
     # Check for test mode flag
     if "--test" in sys.argv or "-t" in sys.argv:
         TEST_MODE = True
-        print("🧪 TEST MODE ENABLED - Processing only first 200 messages\n")
+        logger.info("🧪 TEST MODE ENABLED - Processing only first 200 messages")
     
-    all_conversations = []
+    # Conversations written per persona, for the summary
+    personas = {}
     
     if persona:
         # Process single persona (used for test mode)
         persona_file = CLEANED_DIR / f"{persona.upper()}.json"
         if not persona_file.exists():
-            print(f"Error: File not found: {persona_file}")
-            print(f"Available files:")
+            logger.error(f"File not found: {persona_file}")
+            logger.error(f"Available files:")
             for f in sorted(CLEANED_DIR.glob("*.json")):
-                print(f"  - {f.stem}")
+                logger.error(f"  - {f.stem}")
             return
         
-        conversations = process_cleaned_file(persona_file)
-        all_conversations.extend(conversations)
+        personas[persona_file.stem.lower()] = process_cleaned_file(persona_file)
     else:
         # Process all personas
         persona_files = sorted(CLEANED_DIR.glob("*.json"))
         if not persona_files:
-            print(f"Error: No cleaned chat files found in {CLEANED_DIR}")
+            logger.error(f"No cleaned chat files found in {CLEANED_DIR}")
             return
         
-        print(f"Processing {len(persona_files)} personas...\n")
-        for persona_file in persona_files:
-            print(f"Processing {persona_file.stem}...")
-            conversations = process_cleaned_file(persona_file)
-            all_conversations.extend(conversations)
+        logger.info(f"Processing {len(persona_files)} personas...")
+        # Personas chunk independently (each writes its own JSONL), one process each.
+        # The LLM server is shared, so its request budget is split between them:
+        # overload means timeouts, and a timed-out question becomes a forced split.
+        max_workers = min(len(persona_files), os.cpu_count() or 1, LLM_MAX_WORKERS)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker,
+            initargs=(TEST_MODE, max(1, LLM_MAX_WORKERS // max_workers)),
+        ) as executor:
+            counts = executor.map(process_cleaned_file, persona_files)
+            for persona_file, count in zip(persona_files, counts):
+                personas[persona_file.stem.lower()] = count
     
     # Print summary stats
-    personas = {}
-    for conv in all_conversations:
-        persona = conv["persona"]
-        personas[persona] = personas.get(persona, 0) + 1
-    
-    print(f"\nSummary by persona:")
+    logger.info(f"Summary by persona:")
     for persona, count in sorted(personas.items()):
-        print(f"  {persona}: {count} conversations")
+        if count:
+            logger.info(f"  {persona}: {count} conversations")
     
-    print(f"\nPersona-specific files saved to {PROCESSED_DIR}/")
-    print(f"Use 'make combine-core' to merge all personas into a single training file.")
+    logger.info(f"Persona-specific files saved to {PROCESSED_DIR}/")
+    logger.info(f"Use 'make combine-core' to merge all personas into a single training file.")
 
 
 if __name__ == "__main__":